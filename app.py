@@ -1,7 +1,16 @@
 import os
-import librosa
-from components import *
-import socket
+import sys
+import functools
+import startup_profile
+if __name__ == "__main__" and "--profile-startup" in sys.argv:
+    startup_profile.install() # has to happen before the GUI modules below are imported
+from PyQt6.QtWidgets import QApplication, QFileDialog, QHBoxLayout, QMessageBox, QScrollArea, QTabWidget, QWidget
+from PyQt6.QtCore import Qt, QTimer, pyqtSignal
+from components import Canvas, Library, DanceBlock, DiagnosticsPanel
+from instrumentation import instruments
+from session import Session
+from dispatch import Dispatcher, targets_from_string
+import export
 # ----------------
 
 # STRUCTURE OF APP 
@@ -10,21 +19,29 @@ import socket
     # app.py -> components.py -> model.py
         # app.py calls classes in components.py, which calls classes in model.py
 # json_handling.py is a container for multiple functions, independent of the above
+# tempo_map.py, audio_io.py, session.py, dispatch.py and instrumentation.py hold the non-display helpers they use
 
 #-----------------
 
 class MainWindow(QWidget): # handles the main window of the app, including Canvas and the Dance Library
+    send_finished_signal = pyqtSignal(object, list) # canvas that sent, results
+
     def __init__(self, dances_csv_path, json_path):
         super().__init__()
         self.setWindowTitle("Shimi Gesture Composer")
         self.dances_csv_path = dances_csv_path
         self.json_path = json_path
+        self.session = Session()
 
-        canvas = Canvas(json_path)
-        self.sequences = canvas.sequence_layout
-        canvas.transport.file_btn.clicked.connect(self.open_file)
-        canvas.transport.send_btn.clicked.connect(self.send_dance_to_shimi)
-        canvas.transport.delete_btn.clicked.connect(self.sequences.delete_all_dances)
+        self.tabs = QTabWidget() # one Canvas per open song
+        self.tabs.setTabsClosable(True)
+        self.tabs.setDocumentMode(True)
+        self.tabs.tabCloseRequested.connect(self.close_song)
+        self.tabs.currentChanged.connect(self.song_changed)
+        self.current_canvas = None
+
+        self.dispatcher = Dispatcher()
+        self.send_finished_signal.connect(self.send_finished_callback) # queued: results arrive on the dispatch thread
 
         library_scroll = QScrollArea()
         library_scroll.setVerticalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAlwaysOn)
@@ -37,10 +54,68 @@ class MainWindow(QWidget): # handles the main window of the app, including Canva
         layout = QHBoxLayout()
         layout.setContentsMargins(0, 0, 0, 0)
         layout.setSpacing(0)
-        layout.addWidget(canvas, 1)
+        layout.addWidget(self.tabs, 1)
         layout.addWidget(library_scroll, 0)
         self.setLayout(layout)
 
+        self.diagnostics = None
+        if instruments.enabled:
+            self.diagnostics = DiagnosticsPanel()
+            dump_path = os.environ.get("SHIMI_DIAGNOSTICS_FILE", "diagnostics.json")
+            self.dump_timer = QTimer(self)
+            self.dump_timer.timeout.connect(lambda: instruments.dump(dump_path))
+            self.dump_timer.start(int(float(os.environ.get("SHIMI_DIAGNOSTICS_INTERVAL", "10")) * 1000))
+
+        self.open_song(json_path)
+
+    @property
+    def sequences(self): # composition of the song on screen
+        return self.tabs.currentWidget().sequence_layout
+
+    def open_song(self, json_path):
+        song = self.session.open_song(json_path)
+        for i in range(self.tabs.count()):
+            if self.tabs.widget(i).song is song:
+                self.tabs.setCurrentIndex(i)
+                return self.tabs.widget(i)
+        try:
+            canvas = Canvas(self.session, song)
+        except Exception:
+            self.session.close_song(song) # so a song that failed to open doesn't stay in the session
+            raise
+        canvas.transport.file_btn.clicked.connect(self.open_file)
+        canvas.transport.send_btn.clicked.connect(self.send_dance_to_shimi)
+        canvas.transport.export_btn.clicked.connect(self.export_composition)
+        canvas.transport.delete_btn.clicked.connect(canvas.sequence_layout.delete_all_dances)
+        self.tabs.setCurrentIndex(self.tabs.addTab(canvas, song.name))
+        return canvas
+
+    def song_changed(self, index):
+        if self.current_canvas is not None and self.tabs.indexOf(self.current_canvas) != -1:
+            self.current_canvas.suspend()
+        self.current_canvas = self.tabs.widget(index)
+        if self.current_canvas is None:
+            return
+        self.session.activate(self.current_canvas.song)
+        canvas = self.current_canvas
+        QTimer.singleShot(0, lambda: canvas.resume() if self.tabs.currentWidget() is canvas else None) # after the tab is drawn
+
+    def close_song(self, index):
+        if self.tabs.count() == 1: # always keep one song open
+            return
+        canvas = self.tabs.widget(index)
+        canvas.suspend()
+        if canvas is self.current_canvas:
+            self.current_canvas = None
+        self.tabs.removeTab(index)
+        self.session.close_song(canvas.song)
+        canvas.deleteLater()
+
+    def show(self):
+        super().show()
+        if self.diagnostics is not None:
+            self.diagnostics.show()
+
     def new_gesture_callback(self, danceblock: DanceBlock):
         danceblock.save(self.dances_csv_path)
         self.library.reload_dances()    
@@ -51,36 +126,65 @@ class MainWindow(QWidget): # handles the main window of the app, including Canva
             "music&data", 
             "JSON (*.json)"
         )
-        print(fname)
+        if not fname:
+            return
+        try:
+            self.open_song(fname)
+        except (OSError, ValueError, KeyError) as e: # no audio next to the json, or a json without beats/segmentation
+            dlg = QMessageBox()
+            dlg.setWindowTitle('Error')
+            dlg.setText(f'Could not open {os.path.basename(fname)}:\n{e}')
+            dlg.exec()
 
     def send_dance_to_shimi(self):
-        dances = self.sequences.play_dances()
-        print (dances)
-
-        # EDIT HERE !!!! --------------
-            # Note: The variable (dances) is the list that we want to send to Shimi
-
-        # server_ip = '127.0.0.1'  
-        # server_port = 12345
-
-        # audio,sr = librosa.load('music&data\EDM\Happier.wav', mono=True, sr=None) 
-
-        # client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        # try:
-        #     client_socket.connect((server_ip, server_port))
-        #     client_socket.sendall(dances.encode())
-        #     client_socket.sendall(audio.encode())
-
-        # except ConnectionRefusedError:
-        #     print("Connection was refused. Make sure the server is running.")
-        # client_socket.close()
-
-        # ----------------------------- thanks
+        canvas = self.tabs.currentWidget()
+        choreography = {
+            "song": canvas.song.name,
+            "dances": [[name, float(beat)] for name, beat in self.sequences.play_dances()],
+            "timeline": self.sequences.compile_timeline().tolist(),
+            "beat_times": canvas.tempo_map.beat_times.tolist(),
+        }
+        targets = targets_from_string(os.environ.get("SHIMI_ROBOTS", "127.0.0.1:12345"))
+        canvas.transport.send_btn.setEnabled(False)
+        self.dispatcher.send_in_background(choreography, targets, functools.partial(self.send_finished_signal.emit, canvas))
+
+    def export_composition(self):
+        canvas = self.tabs.currentWidget()
+        fname, _ = QFileDialog().getSaveFileName(self,
+            "Export Dance and Song",
+            f"{canvas.song.name}.shimi",
+            "Shimi export (*.shimi)"
+        )
+        if not fname:
+            return
+        analysis = self.session.analysis(canvas.song)
+        with instruments.timer("export"):
+            export.export_composition(fname, canvas.song.name, self.session.audio(canvas.song), canvas.tempo_map,
+                                      analysis.segmentation, self.sequences.play_dances(),
+                                      self.sequences.compile_timeline())
+
+    def send_finished_callback(self, canvas, results):
+        if self.tabs.indexOf(canvas) != -1: # the tab may have been closed while sending
+            canvas.transport.send_btn.setEnabled(True)
+        failed = [r for r in results if not r.ok]
+        if failed:
+            dlg = QMessageBox()
+            dlg.setWindowTitle('Error')
+            dlg.setText(f'{len(results) - len(failed)}/{len(results)} robots got the dance.\n' +
+                        '\n'.join(f'{r.target.name}: {r.error}' for r in failed))
+            dlg.exec()
 
 
 if __name__ == "__main__":
+    startup_profile.phase("imports")
+    if "--diagnostics" in sys.argv:
+        instruments.enabled = True
     app = QApplication([])
-    json_path = "music&data\EDM\Happier.json"
+    json_path = os.path.join("music&data", "EDM", "Happier.json")
     window = MainWindow(dances_csv_path="gestures", json_path=json_path)
+    startup_profile.phase("main window built")
     window.show()
+    startup_profile.phase("main window shown")
+    if "--profile-startup" in sys.argv:
+        QTimer.singleShot(0, lambda: (startup_profile.phase("first event loop pass"), startup_profile.report()))
     app.exec()
@@ -0,0 +1,181 @@
+import os
+import struct
+import numpy as np
+
+# opens songs for playback and waveform drawing without decoding them up front
+# .wav files are memory-mapped and converted to mono float32 one block at a time,
+# anything else (mp3, flac, ogg...) is decoded by librosa the first time it is needed
+
+AUDIO_EXTENSIONS = ['.wav', '.flac', '.ogg', '.mp3', '.m4a']
+
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_IEEE_FLOAT = 0x0003
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+
+class WavReader: # memory-mapped PCM data of a .wav file, read as mono float32 blocks
+    def __init__(self, path):
+        self.path = path
+        fmt, data_offset, data_size = self.parse_chunks(path)
+        audio_format, self.channels, self.sr, _, block_align, self.bits = struct.unpack('<HHIIHH', fmt[:16])
+        if audio_format == WAVE_FORMAT_EXTENSIBLE:
+            audio_format = struct.unpack('<H', fmt[24:26])[0]
+        self.frame_bytes = block_align
+        self.frames = data_size // block_align
+
+        if audio_format == WAVE_FORMAT_IEEE_FLOAT and self.bits in (32, 64):
+            dtype, self.scale, self.zero = np.dtype(f'<f{self.bits // 8}'), 1.0, 0.0
+        elif audio_format == WAVE_FORMAT_PCM and self.bits == 8:
+            dtype, self.scale, self.zero = np.dtype('u1'), 1 / 128, 128.0
+        elif audio_format == WAVE_FORMAT_PCM and self.bits in (16, 32):
+            dtype, self.scale, self.zero = np.dtype(f'<i{self.bits // 8}'), 1 / 2 ** (self.bits - 1), 0.0
+        elif audio_format == WAVE_FORMAT_PCM and self.bits == 24:
+            dtype, self.scale, self.zero = np.dtype('u1'), 1 / 2 ** 23, 0.0
+        else:
+            raise ValueError(f"{path}: unsupported wav encoding (format {audio_format}, {self.bits} bit)")
+
+        shape = (self.frames, self.channels, 3) if self.bits == 24 else (self.frames, self.channels)
+        self.pcm = np.memmap(path, dtype=dtype, mode='r', offset=data_offset, shape=shape) if self.frames else np.zeros(shape, dtype)
+
+    @staticmethod
+    def parse_chunks(path): # returns the fmt chunk and where the sample data lives
+        fmt, data_offset, data_size = None, None, None
+        file_size = os.path.getsize(path)
+        with open(path, 'rb') as f:
+            riff, _, wave = struct.unpack('<4sI4s', f.read(12))
+            if riff != b'RIFF' or wave != b'WAVE':
+                raise ValueError(f"{path} is not a RIFF/WAVE file")
+            while data_offset is None or fmt is None:
+                header = f.read(8)
+                if len(header) < 8:
+                    break
+                chunk_id, size = struct.unpack('<4sI', header)
+                if chunk_id == b'fmt ':
+                    fmt = f.read(size)
+                elif chunk_id == b'data':
+                    data_offset = f.tell()
+                    data_size = min(size, file_size - data_offset) # streamed files leave size at 0 or 0xFFFFFFFF
+                    if size in (0, 0xFFFFFFFF):
+                        data_size = file_size - data_offset
+                    f.seek(data_size, os.SEEK_CUR)
+                else:
+                    f.seek(size, os.SEEK_CUR)
+                if size % 2:
+                    f.seek(1, os.SEEK_CUR)
+        if fmt is None or data_offset is None:
+            raise ValueError(f"{path} has no fmt or data chunk")
+        return fmt, data_offset, data_size
+
+    def __len__(self):
+        return self.frames
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice) or index.step not in (None, 1):
+            raise TypeError("WavReader only supports contiguous slices")
+        start, stop, _ = index.indices(self.frames)
+        return self.read(start, stop - start)
+
+    def read(self, start, frames): # mono float32 samples [start, start + frames)
+        start = max(int(start), 0)
+        stop = min(start + max(int(frames), 0), self.frames)
+        if stop <= start:
+            return np.zeros(0, dtype=np.float32)
+        block = self.pcm[start:stop]
+        if self.bits == 24:
+            block = block.astype(np.int32)
+            block = (block[..., 0] | (block[..., 1] << 8) | (block[..., 2] << 16)) << 8 >> 8 # sign-extend
+        block = block.astype(np.float32)
+        if self.zero:
+            block -= self.zero
+        if self.channels > 1:
+            block = block.mean(axis=1)
+        else:
+            block = block[:, 0]
+        if self.scale != 1.0:
+            block *= self.scale
+        return np.ascontiguousarray(block, dtype=np.float32)
+
+    def blocks(self, block_size=1 << 16): # yields (start frame, samples) over the whole file
+        for start in range(0, self.frames, block_size):
+            yield start, self.read(start, block_size)
+
+    @property
+    def nbytes(self): # resident cost; the samples themselves live in the OS page cache
+        return 4096
+
+
+class DecodedAudio: # compressed formats, decoded by librosa on first access
+    def __init__(self, path):
+        self.path = path
+        self._audio, self._sr, self._frames = None, None, None
+
+    def decode(self):
+        if self._audio is None:
+            import librosa
+            self._audio, self._sr = librosa.load(self.path, mono=True, sr=None)
+        return self._audio
+
+    @property
+    def sr(self): # read from the file header, so asking for it doesn't decode the song
+        if self._sr is None:
+            import librosa
+            self._sr = librosa.get_samplerate(self.path)
+        return self._sr
+
+    def __len__(self):
+        if self._audio is not None:
+            return len(self._audio)
+        if self._frames is None:
+            import librosa
+            self._frames = int(round(librosa.get_duration(path=self.path) * self.sr))
+        return self._frames
+
+    def __getitem__(self, index):
+        return self.decode()[index]
+
+    def read(self, start, frames):
+        start = max(int(start), 0)
+        return self.decode()[start:start + max(int(frames), 0)]
+
+    @property
+    def nbytes(self):
+        return 0 if self._audio is None else self._audio.nbytes
+
+    def blocks(self, block_size=1 << 16):
+        audio = self.decode()
+        for start in range(0, len(audio), block_size):
+            yield start, audio[start:start + block_size]
+
+
+def compress(x: np.ndarray, kernel): # peak with the largest magnitude in each window of kernel samples
+    windows = np.asarray(x)[:len(x) // kernel * kernel].reshape(-1, kernel)
+    m = windows.max(axis=1)
+    n = windows.min(axis=1)
+    return np.where(m < np.abs(n), n, m).astype(float)
+
+
+def compress_blocks(audio, kernel, block_size=1 << 20): # compress() over an audio reader, one block at a time
+    block_size = max(block_size // kernel, 1) * kernel
+    out = [compress(block, kernel) for _, block in audio.blocks(block_size)]
+    return np.concatenate(out) if out else np.zeros(0)
+
+
+def waveform_pyramid(audio, kernel, levels=4): # level n holds the peaks of kernel * 2**n sample windows
+    pyramid = [compress_blocks(audio, kernel)]
+    for _ in range(1, levels):
+        pyramid.append(compress(pyramid[-1], 2))
+    return pyramid
+
+
+def open_audio(path): # WavReader for .wav files, librosa for everything else
+    if os.path.splitext(path)[1].lower() == '.wav':
+        return WavReader(path)
+    return DecodedAudio(path)
+
+
+def audio_path(json_path): # the song that sits next to an analysis json
+    base = os.path.splitext(json_path)[0]
+    for ext in AUDIO_EXTENSIONS:
+        if os.path.exists(base + ext):
+            return base + ext
+    return base + '.wav'
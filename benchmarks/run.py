@@ -0,0 +1,204 @@
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import numpy as np
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PyQt6.QtWidgets import QApplication
+import json_handling
+from audio_io import open_audio, audio_path
+from tempo_map import TempoMap
+from components import WaveformView, Library, SequenceLayout, TransportBar
+from session import Song, Analysis
+from model import DanceBlock, InstructionSet
+from benchmarks import synthetic
+
+# headless benchmarks of the app's hot paths
+#   python -m benchmarks.run                                  prints and writes results as json
+#   python -m benchmarks.run --save-baseline                  stores them as the baseline
+#   python -m benchmarks.run --baseline                       fails when something got slower than the baseline
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+
+def measure(fn, repeats=5, min_time=0.05): # median and min seconds per call
+    fn()
+    calls = 1
+    start = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - start
+    if elapsed < min_time:
+        calls = int(min_time / max(elapsed, 1e-9)) + 1
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for _ in range(calls):
+            fn()
+        times.append((time.perf_counter() - start) / calls)
+    return {"median": float(np.median(times)), "min": float(min(times)), "calls": calls * repeats}
+
+
+def calibration_workload(): # fixed mix of interpreter and numpy work; how fast this machine is right now
+    total = 0
+    for i in range(20000):
+        total += i % 7
+    np.sort(np.random.default_rng(0).random(50000))
+    return total
+
+
+class Suite:
+    def __init__(self, workdir, quick=False):
+        self.workdir = workdir
+        self.quick = quick
+        self.results = {}
+        self.songs = {}
+
+    def song(self, seconds, segments=12):
+        key = (seconds, segments)
+        if key not in self.songs:
+            self.songs[key] = synthetic.write_song(self.workdir, f"song_{int(seconds)}s_{segments}seg",
+                                                   seconds=seconds, segments=segments)
+        return self.songs[key]
+
+    def record(self, name, fn, **kwargs):
+        result = measure(fn, **kwargs)
+        previous = self.results.get(name)
+        if previous is not None: # a later round: keep the best of each, so a burst of load in one round doesn't count
+            result = {"median": min(previous["median"], result["median"]), "min": min(previous["min"], result["min"]),
+                      "calls": previous["calls"] + result["calls"]}
+        self.results[name] = result
+        print(f"{name:50s} {self.results[name]['median'] * 1e3:12.4f} ms", flush=True)
+
+    def song_lengths(self):
+        return [30, 300] if self.quick else [30, 300, 1800]
+
+    def bench_compress(self):
+        for seconds in self.song_lengths():
+            audio = open_audio(audio_path(self.song(seconds)))
+            x = audio.read(0, len(audio))
+            self.record(f"waveform.compress[{seconds}s]", lambda: WaveformView.compress(x, 127))
+            self.record(f"waveform.compress_blocks[{seconds}s]", lambda: WaveformView.compress_blocks(audio, 127))
+
+    def bench_json_lookups(self):
+        for seconds in self.song_lengths():
+            path = self.song(seconds)
+            song_length = seconds
+            self.record(f"json_handling.beatseek[{seconds}s]", lambda: json_handling.beatseek(song_length * 22050 / 2, path, 22050))
+            self.record(f"json_handling.mouse_quantizetobeats[{seconds}s]",
+                        lambda: json_handling.mouse_quantizetobeats(path, 500, song_length, 1000))
+            self.record(f"json_handling.segmentation_beats[{seconds}s]", lambda: json_handling.segmentation_beats(path))
+            tempo_map = TempoMap.from_json(path, song_length, 22050)
+            self.record(f"tempo_map.nearest_beat[{seconds}s]", lambda: tempo_map.nearest_beat(song_length / 2))
+            self.record(f"tempo_map.quantize_pixels[{seconds}s]", lambda: tempo_map.quantize_pixels(500, 1000))
+
+    def bench_library(self):
+        for count in ([10, 1000] if self.quick else [10, 1000, 10000]):
+            directory = synthetic.write_library(os.path.join(self.workdir, f"library_{count}"), count)
+            self.record(f"library.load_danceblock[{count}]", lambda: Library.load_danceblock(directory),
+                        repeats=5, min_time=0.2)
+
+    def bench_play_dances(self):
+        rng = np.random.default_rng(0)
+        library = [DanceBlock(f"g{n}", InstructionSet(synthetic.random_instructions(rng, beats=1))) for n in range(50)]
+        for seconds, segments in ([(300, 50)] if self.quick else [(300, 50), (1800, 300)]):
+            path = self.song(seconds, segments)
+            layout = SequenceLayout(path, 1000, Analysis(Song(path), open_audio(audio_path(path))))
+            placed = 0
+            for view in layout.sequence_array:
+                for beat in np.arange(0, view.length_inbeats - 1):
+                    view.sequence.place(library[placed % len(library)], beat)
+                    placed += 1
+            self.record(f"sequence_layout.play_dances[{segments}seg,{placed}gestures]", layout.play_dances, repeats=3)
+
+    def bench_playback_callback(self):
+        path = self.song(300)
+        audio = open_audio(audio_path(path))
+        transport = TransportBar(path)
+        transport.set_audio(audio, audio.sr)
+        transport.set_tempo(TempoMap.from_json(path, len(audio) / audio.sr, audio.sr))
+
+        def callback():
+            if transport.currentPosition + 1024 >= len(audio):
+                transport.currentPosition = 0
+            transport.stream_callback(None, 1024, None, 0)
+        self.record("transport.stream_callback[1024 frames]", callback)
+
+    def run(self, only=None, rounds=1): # rounds are spread out in time, every benchmark keeps its best round
+        benches = [self.bench_compress, self.bench_json_lookups, self.bench_library, self.bench_play_dances,
+                   self.bench_playback_callback]
+        for _ in range(rounds):
+            self.record("calibration", calibration_workload)
+            for bench in benches:
+                if only is None or only in bench.__name__:
+                    bench()
+        return self.results
+
+
+def compare(results, baseline, tolerance): # names whose best time got slower than baseline * (1 + tolerance)
+    # the minimum is compared rather than the median: noise from other processes only ever adds time;
+    # times are scaled by the calibration workload, so a machine that is slower all run long (throttled,
+    # shared) doesn't show up as a regression everywhere
+    scale = 1.0
+    if "calibration" in results and "calibration" in baseline:
+        scale = results["calibration"]["min"] / max(baseline["calibration"]["min"], 1e-12)
+        print(f"{'calibration':50s} x{scale:6.2f} (machine speed against the baseline, divided out below)")
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline or name == "calibration":
+            continue
+        ratio = result["min"] / max(baseline[name]["min"], 1e-12) / scale
+        flag = "REGRESSION" if ratio > 1 + tolerance else ""
+        print(f"{name:50s} x{ratio:6.2f} {flag}")
+        if flag:
+            regressions.append(name)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks for the Shimi gesture composer")
+    parser.add_argument("--out", default="bench_output.json", help="where to write the results")
+    parser.add_argument("--baseline", nargs='?', const=DEFAULT_BASELINE, default=None,
+                        help=f"baseline json to compare against (default {DEFAULT_BASELINE})")
+    parser.add_argument("--save-baseline", action="store_true", help=f"also write the results to {DEFAULT_BASELINE}")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown before failing (0.25 = 25%%)")
+    parser.add_argument("--quick", action="store_true", help="shorter songs and smaller libraries")
+    parser.add_argument("--rounds", type=int, default=3, help="times the whole suite is run, the best round counts")
+    parser.add_argument("--only", default=None, help="run benchmarks whose name contains this")
+    args = parser.parse_args(argv)
+    if args.baseline is not None and not os.path.exists(args.baseline): # checked up front, before the suite runs
+        print(f"no baseline at {args.baseline}; record one with --save-baseline first", file=sys.stderr)
+        return 2
+
+    app = QApplication.instance() or QApplication([])
+    with tempfile.TemporaryDirectory() as workdir:
+        results = Suite(workdir, quick=args.quick).run(args.only, args.rounds)
+
+    report = {
+        "meta": {"python": platform.python_version(), "platform": platform.platform(), "numpy": np.__version__,
+                 "timestamp": time.time(), "quick": args.quick},
+        "results": results,
+    }
+    with open(args.out, 'w') as f:
+        json.dump(report, f, indent=2)
+    if args.save_baseline:
+        with open(DEFAULT_BASELINE, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} benchmark(s) regressed by more than {args.tolerance:.0%}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
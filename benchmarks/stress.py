@@ -0,0 +1,200 @@
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import tracemalloc
+import numpy as np
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PyQt6.QtWidgets import QApplication
+from PyQt6.QtCore import QMimeData, QPointF, Qt
+from PyQt6.QtGui import QDropEvent
+from app import MainWindow
+from instrumentation import instruments
+from benchmarks import synthetic
+
+# drives the whole GUI headlessly against a long synthetic song and a big gesture library,
+# scripting drops, deletes, resizes, segment changes and playback, and fails when
+# event loop latency or memory growth go over the thresholds
+#   python -m benchmarks.stress                     (exit code 1 when a threshold is exceeded)
+#   python -m benchmarks.stress --segments 500 --gestures 5000 --out stress.json
+
+# interactive steps are judged on their 95th percentile and bulk rebuilds on their median, so one stray
+# sample (a gc pause, the first layout of a widget) can't fail a clean tree on its own.
+# defaults: at the default sizes drops, deletes, segment changes and playback stay under ~5 ms at p95,
+# and a library reload takes 2.8-4.5 s (resize ~0.3 s, clear ~0.1 s) depending on the machine;
+# --max-p95-ms 50 and --max-bulk-ms 12000 leave about 10x and 2.5x headroom over those runs
+BULK_STEPS = {"resize", "clear_all", "library_reload"} # rebuild everything on screen, judged against --max-bulk-ms
+
+
+def rss_bytes(): # current resident set size, or the peak where /proc isn't available
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        import resource
+        scale = 1 if sys.platform == "darwin" else 1024
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+class Harness:
+    def __init__(self, app, window: MainWindow, rng):
+        self.app = app
+        self.window = window
+        self.rng = rng
+        self.latencies = {} # step name -> list of seconds the event loop was busy
+
+    @property
+    def canvas(self):
+        return self.window.tabs.currentWidget()
+
+    def step(self, name, fn): # runs fn as an event handler would, then lets Qt repaint and relayout
+        start = time.perf_counter()
+        fn()
+        self.app.processEvents()
+        self.latencies.setdefault(name, []).append(time.perf_counter() - start)
+
+    def drop(self, view, dance, x):
+        mime_data = QMimeData()
+        mime_data.setText(dance.name)
+        mime_data.setData("application/octet-stream", dance.instructions.tobytes())
+        mime_data.setColorData(dance.color)
+        mime_data.setParent(self.window.library)
+        event = QDropEvent(QPointF(x, 5), Qt.DropAction.CopyAction, mime_data,
+                           Qt.MouseButton.LeftButton, Qt.KeyboardModifier.NoModifier)
+        view.dropEvent(event)
+
+    def fill_segments(self, per_segment):
+        dances = list(self.window.library.dances.values())
+        layout = self.canvas.sequence_layout
+        for view in layout.sequence_array:
+            for _ in range(per_segment):
+                dance = dances[self.rng.integers(len(dances))]
+                start = view.sequence.first_fit(dance.length_accurate(), at=self.rng.random() * view.length_inbeats / 2)
+                if start is None:
+                    break
+                x = (start + 0.1) / view.length_inbeats * max(view.width(), 1)
+                if view.sequence.quantize(x / max(view.width(), 1) * view.length_inbeats) != start:
+                    continue # too narrow on screen to aim at that beat
+                self.step("drop", lambda: self.drop(view, dance, x))
+
+    def delete_some(self, fraction):
+        for view in self.canvas.sequence_layout.sequence_array:
+            for placement in view.sequence.placements():
+                if self.rng.random() < fraction:
+                    self.step("delete", lambda: view.delete_callback(None, placement.id))
+
+    def resize(self, sizes):
+        for width, height in sizes:
+            self.step("resize", lambda: self.window.resize(width, height))
+
+    def navigate(self, count):
+        for _ in range(count):
+            self.step("segment", lambda: (self.canvas.sequence_layout.next_SequenceView(), self.canvas.lbl_text()))
+
+    def play(self, seconds, frames=1024):
+        transport = self.canvas.transport
+        transport.seek(0)
+        for _ in range(int(seconds * transport.fs / frames)):
+            self.step("playback", lambda: transport.stream_callback(None, frames, None, 0))
+
+    def clear(self):
+        self.step("clear_all", self.canvas.sequence_layout.delete_all_dances)
+
+    def reload_library(self):
+        self.step("library_reload", self.window.library.reload_dances)
+
+    def summary(self):
+        return {name: {"count": len(t), "mean_ms": float(np.mean(t)) * 1e3, "median_ms": float(np.median(t)) * 1e3,
+                       "p95_ms": float(np.percentile(t, 95)) * 1e3,
+                       "max_ms": float(np.max(t)) * 1e3} for name, t in self.latencies.items()}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Headless stress test of the Shimi gesture composer")
+    parser.add_argument("--seconds", type=float, default=1800, help="length of the synthetic song")
+    parser.add_argument("--segments", type=int, default=300)
+    parser.add_argument("--gestures", type=int, default=2000, help="size of the synthetic gesture library")
+    parser.add_argument("--per-segment", type=int, default=4, help="gestures dropped into every segment per cycle")
+    parser.add_argument("--cycles", type=int, default=3, help="fill/delete/clear cycles, memory is compared between them")
+    parser.add_argument("--play-seconds", type=float, default=20, help="seconds of playback per cycle")
+    parser.add_argument("--max-p95-ms", type=float, default=50, help="fail if an interactive step's 95th percentile is slower")
+    parser.add_argument("--max-bulk-ms", type=float, default=12000, help="fail if the median resize, clear or library reload is slower")
+    parser.add_argument("--max-growth-mb", type=float, default=50, help="fail if memory grows more between the first and last cycle")
+    parser.add_argument("--out", default=None, help="write the report as json here")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    instruments.enabled = True
+    app = QApplication.instance() or QApplication([])
+    rng = np.random.default_rng(args.seed)
+    with tempfile.TemporaryDirectory() as workdir:
+        json_path = synthetic.write_song(os.path.join(workdir, "song"), "stress", seconds=args.seconds,
+                                         segments=args.segments, seed=args.seed)
+        library_path = synthetic.write_library(os.path.join(workdir, "gestures"), args.gestures, seed=args.seed)
+        os.environ.setdefault("SHIMI_DIAGNOSTICS_FILE", os.path.join(workdir, "diagnostics.json")) # not the current directory
+
+        start = time.perf_counter()
+        window = MainWindow(dances_csv_path=library_path, json_path=json_path)
+        window.resize(1400, 800)
+        window.show()
+        app.processEvents()
+        app.processEvents()
+        startup = time.perf_counter() - start
+
+        harness = Harness(app, window, rng)
+        tracemalloc.start()
+        memory = []
+        for cycle in range(args.cycles):
+            harness.fill_segments(args.per_segment)
+            harness.resize([(1000, 700), (1600, 900), (1400, 800)])
+            harness.navigate(min(args.segments, 50))
+            harness.play(args.play_seconds)
+            harness.delete_some(0.3)
+            harness.clear()
+            harness.reload_library()
+            app.processEvents()
+            memory.append({"rss": rss_bytes(), "python": tracemalloc.get_traced_memory()[0]})
+        tracemalloc.stop()
+
+        steps = harness.summary()
+        growth_mb = (memory[-1]["python"] - memory[0]["python"]) / 2 ** 20
+        report = {
+            "config": vars(args),
+            "startup_s": startup,
+            "steps": steps,
+            "memory": memory,
+            "python_memory_growth_mb": growth_mb,
+            "rss_growth_mb": (memory[-1]["rss"] - memory[0]["rss"]) / 2 ** 20,
+            "instruments": instruments.snapshot(),
+        }
+        window.close()
+
+    failures = []
+    for name, stat in steps.items():
+        print(f"{name:16s} n={stat['count']:6d}  mean {stat['mean_ms']:8.2f} ms  median {stat['median_ms']:8.2f} ms  p95 {stat['p95_ms']:8.2f} ms  max {stat['max_ms']:8.2f} ms")
+        if name in BULK_STEPS:
+            if stat["median_ms"] > args.max_bulk_ms:
+                failures.append(f"{name}: median {stat['median_ms']:.1f} ms > {args.max_bulk_ms} ms")
+        elif stat["p95_ms"] > args.max_p95_ms:
+            failures.append(f"{name}: p95 {stat['p95_ms']:.1f} ms > {args.max_p95_ms} ms")
+    print(f"startup {startup:.2f} s, python memory growth {growth_mb:.2f} MB over {args.cycles} cycles, "
+          f"rss growth {report['rss_growth_mb']:.1f} MB")
+    if growth_mb > args.max_growth_mb:
+        failures.append(f"memory grew {growth_mb:.1f} MB > {args.max_growth_mb} MB")
+    report["failures"] = failures
+
+    if args.out is not None:
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=2)
+    for failure in failures:
+        print("FAIL", failure)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
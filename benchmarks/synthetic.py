@@ -0,0 +1,49 @@
+import os
+import json
+import wave
+import numpy as np
+
+# synthetic songs and gesture libraries for the benchmarks and the stress harness
+# songs are a .wav plus the analysis .json the app expects (beats, tempo, segmentation)
+
+def write_song(directory, name="synthetic", seconds=60.0, sr=22050, bpm=100.0, segments=12, seed=0):
+    rng = np.random.default_rng(seed)
+    os.makedirs(directory, exist_ok=True)
+    json_path = os.path.join(directory, f"{name}.json")
+    wav_path = os.path.join(directory, f"{name}.wav")
+
+    period = 60 / bpm
+    beats = np.cumsum(np.full(int(seconds / period), period) * rng.normal(1, 0.01, int(seconds / period)))
+    beats = beats[beats < seconds]
+    cuts = np.sort(rng.choice(np.arange(1, len(beats) - 1), size=min(segments - 1, len(beats) - 2), replace=False))
+    segmentation = [[0.0, 0.0]] + [[float(beats[i]), float(rng.random() * 0.1)] for i in cuts] + [[float(seconds), 0.0]]
+    with open(json_path, 'w') as f:
+        json.dump({"segmentation": segmentation, "verticals": [], "beats": beats.tolist(), "tempo": bpm}, f)
+
+    block = sr * 10
+    with wave.open(wav_path, 'wb') as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(sr)
+        for start in range(0, int(seconds * sr), block):
+            t = np.arange(start, min(start + block, int(seconds * sr))) / sr
+            x = 0.5 * np.sin(2 * np.pi * 220 * t) * np.exp(-8 * ((t / period) % 1))
+            w.writeframes((x * 32767).astype('<i2').tobytes())
+    return json_path
+
+
+def random_instructions(rng, beats=4):
+    rows = []
+    for motor in rng.choice(np.arange(1, 6), size=rng.integers(1, 4), replace=False):
+        for beat in np.arange(0, beats, 0.5):
+            rows.append([float(motor), float(beat), round(float(rng.random()), 1), 0.5])
+    return rows
+
+
+def write_library(directory, count, seed=0): # count gesture csv files named synthetic_<n>.csv
+    rng = np.random.default_rng(seed)
+    os.makedirs(directory, exist_ok=True)
+    for n in range(count):
+        rows = random_instructions(rng, beats=int(rng.integers(1, 5)))
+        np.savetxt(os.path.join(directory, f"synthetic_{n}.csv"), rows, delimiter=',', fmt='%g')
+    return directory
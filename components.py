@@ -1,20 +1,28 @@
 import glob
 import os.path
 import random
+import time
 import typing
-import librosa
-from PyQt6.QtWidgets import *
-from pyqtgraph import PlotWidget, plot
+from PyQt6.QtWidgets import (QDialog, QFrame, QHBoxLayout, QInputDialog, QLabel, QLineEdit, QMenu, QMessageBox,
+                             QPushButton, QStackedLayout, QTableView, QVBoxLayout, QWidget)
+from pyqtgraph import PlotWidget
 from PyQt6.QtCore import Qt, pyqtSignal
 from PyQt6 import QtCore
 from PyQt6 import QtGui
 import numpy as np
-import pyaudio
-from model import *
-import json_handling
+from model import InstructionSet, DanceBlock, Sequence, Composition
+from tempo_map import TempoMap
+import audio_io
+from instrumentation import instruments
+from session import Session, Song, Analysis
+from segment_cursor import SegmentCursor
+import gesture_tools
 
 # handles all display elements 
 
+PA_CONTINUE = 0 # pyaudio.paContinue, so the audio callback doesn't need pyaudio imported
+PA_OUTPUT_UNDERFLOW = 0x4 # pyaudio.paOutputUnderflow status flag
+
 class TransportBar(QFrame):
     position_signal = pyqtSignal(float)
     stream_ended_signal = pyqtSignal()
@@ -22,7 +30,6 @@ class TransportBar(QFrame):
     def __init__(self,json_path):
         super().__init__()
         self.json_path = json_path
-        self.input = self.json_path[:-5] + '.wav'
 
         self.play_btn = QPushButton(text="Play")
         self.play_btn.clicked.connect(self.play_pause)
@@ -33,6 +40,9 @@ class TransportBar(QFrame):
 
         self.file_btn = QPushButton(text = "Open JSON")
 
+        self.export_btn = QPushButton(text="Export")
+        self.export_btn.setToolTip('Saves the dance and the song in one file for offline playback on Shimi.')
+
         self.time_lbl = QLabel(self.format_seconds(0))
         self.tempo_lbl = QLabel()
         self.beat_lbl = QLabel("Beat: 0")
@@ -43,7 +53,8 @@ class TransportBar(QFrame):
         layout = QHBoxLayout()
         layout.addWidget(self.play_btn, 0)
         layout.addWidget(self.send_btn,0)
-        # layout.addWidget(self.file_btn,0)
+        layout.addWidget(self.file_btn,0)
+        layout.addWidget(self.export_btn,0)
         layout.addWidget(self.time_lbl, 1)
         layout.addWidget(self.beat_lbl,1)
         layout.addWidget(self.tempo_lbl, 1)
@@ -54,7 +65,7 @@ class TransportBar(QFrame):
         self.audio, self.fs = None, None
         self.currentPosition = 0
 
-        self.p = pyaudio.PyAudio()
+        self.p = None # audio device, opened on first play
         self.stream = None
 
         self.stream_ended_signal.connect(self.stream_ended_callback)
@@ -62,7 +73,14 @@ class TransportBar(QFrame):
     def __del__(self):
         if self.stream is not None:
             self.stream.close()
-        self.p.terminate()
+        if self.p is not None:
+            self.p.terminate()
+
+    def audio_device(self):
+        if self.p is None:
+            import pyaudio
+            self.p = pyaudio.PyAudio()
+        return self.p
 
     def seek(self, percentage):
         self.currentPosition = int(percentage * len(self.audio))
@@ -70,7 +88,7 @@ class TransportBar(QFrame):
         self.beat_define(self.currentPosition)
 
     def beat_define(self,position):
-        self.beat_number = json_handling.beatseek(position, self.json_path, self.fs)
+        self.beat_number = self.tempo_map.nearest_beat(position / self.fs)
         self.beat_lbl.setText(f"Beat: {self.beat_number}")
        
     @staticmethod
@@ -94,9 +112,10 @@ class TransportBar(QFrame):
         self.audio = audio
         self.fs = fs
 
-    def set_tempo(self, tempo):
-        self.tempo = json_handling.tempo(self.json_path)
-        self.tempo_lbl.setText("BPM: " f"{self.tempo}")
+    def set_tempo(self, tempo_map: TempoMap):
+        self.tempo_map = tempo_map
+        self.tempo = tempo_map.bpm
+        self.tempo_lbl.setText("BPM: " f"{self.tempo:.2f}")
 
     def play_pause(self):
         if not self.is_playing:
@@ -107,18 +126,22 @@ class TransportBar(QFrame):
     def play(self):
         self.is_playing = True
         self.play_btn.setText("Pause")
-        self.stream = self.p.open(format=pyaudio.paFloat32,
-                                  channels=1,
-                                  rate=self.fs,
-                                  output=True,
-                                  stream_callback=self.stream_callback)
+        import pyaudio
+        self.stream = self.audio_device().open(format=pyaudio.paFloat32,
+                                               channels=1,
+                                               rate=self.fs,
+                                               output=True,
+                                               stream_callback=self.stream_callback)
 
     def pause(self):
         self.is_playing = False
         self.play_btn.setText("Play")
         self.stream.stop_stream()
 
+    @instruments.timed("audio.callback")
     def stream_callback(self, in_data, frame_count, time_info, status):
+        if status & PA_OUTPUT_UNDERFLOW:
+            instruments.count("audio.underruns")
         end = np.minimum(self.currentPosition + frame_count, self.currentPosition + len(self.audio))
         data = self.audio[self.currentPosition: end]
         self.currentPosition += len(data)
@@ -128,7 +151,7 @@ class TransportBar(QFrame):
             self.stream_ended_signal.emit()
         self.beat_define(self.currentPosition)
         self.time_lbl.setText(self.format_seconds(sec))
-        return data, pyaudio.paContinue
+        return data, PA_CONTINUE
       
     def stream_ended_callback(self):
         self.pause()
@@ -140,7 +163,6 @@ class WaveformView(PlotWidget):
     def __init__(self, json_path,mouse_press_callback):
         super().__init__()
         self.json_path = json_path
-        self.input = self.json_path[:-5] + '.wav'
         self.mouse_press_callback = mouse_press_callback
         self.getPlotItem().hideAxis('left')
 
@@ -151,23 +173,21 @@ class WaveformView(PlotWidget):
         self.hideButtons()
         self.setAcceptDrops(False)
 
-        audio, self.sr = librosa.load(self.input, mono=True, sr=None)
+        self.sr = None
+        self.kernel = None
+        self.segmentation = [] # segment boundaries in seconds, for the ticks
         self.bar_height = self.height()/2
 
-    @staticmethod
-    def compress(x: np.ndarray, kernel):
-        out = np.zeros(len(x) // kernel)
-        for i in range(len(out)):
-            temp = x[i * kernel: (i + 1) * kernel]
-            m = np.max(temp)
-            n = np.min(temp)
-            if m < abs(n):
-                m = n
-            out[i] = m
-        return out
+    compress = staticmethod(audio_io.compress)
+    compress_blocks = staticmethod(audio_io.compress_blocks)
+
+    def render(self, audio, kernel=5):
+        self.show_waveform(self.compress_blocks(audio, kernel), audio.sr, kernel)
 
-    def render(self, x, kernel=5):
-        x = self.compress(x, kernel)
+    def show_waveform(self, x, sr, kernel): # plots peaks already compressed with kernel
+        self.clear()
+        self.sr = sr
+        self.kernel = kernel
         self.length = len(x)
         self.ticks(kernel)
         self.setXRange(0,len(x),padding=0)
@@ -184,22 +204,17 @@ class WaveformView(PlotWidget):
 
     def ticks(self, kernel):
         ax = self.getAxis('bottom')
-        seg_values = json_handling.plot_segmentation(self.json_path,self.sr,kernel)
-        seg_lbls = []
-        for i in np.arange(len(seg_values)):
-            seg_lbls = np.append(seg_lbls,str(i))
-        array = [(seg_values[x], seg_lbls[x]) for x in np.arange(len(seg_values))]
-        ax.setTicks([array])
+        seg_values = np.asarray(self.segmentation[:-1]) * self.sr / kernel # segment starts, in peaks
+        ax.setTicks([[(float(x), str(i)) for i, x in enumerate(seg_values)]])
     
     def reset(self):
         self.setXRange(0,self.length,padding=0)
     
 class  SequenceView(QWidget):
     valueChanged = pyqtSignal()
-    def __init__(self,json_path,length_inbeats):
+    def __init__(self,json_path,length_inbeats,sequence: Sequence = None):
         super().__init__()
         self.json_path = json_path
-        self.input = self.json_path[:-5] + '.wav'
         layout = QHBoxLayout()
         layout.setContentsMargins(0, 0, 0, 0)
         layout.setSpacing(0)
@@ -212,72 +227,109 @@ class  SequenceView(QWidget):
         self.setPalette(p)
         self.setAcceptDrops(True)
 
-        self.sequence = Sequence()
-
         self.length_inbeats = length_inbeats
-        self.dance_length = 0.0
-        self.setToolTip(f'{self.length_inbeats - self.dance_length} beats left')
+        self.sequence = Sequence(self.length_inbeats) if sequence is None else sequence
+        self.update_tooltip()
+
+    def update_tooltip(self):
+        self.setToolTip(f'{self.sequence.beats_left()} beats left')
+
+    def beat_at(self, x, offset=0.0): # quantized beat offset under a pixel position in this segment, minus offset beats
+        return self.sequence.quantize(x / max(self.width(), 1) * self.length_inbeats - offset)
 
-        self.tempo = json_handling.tempo(self.json_path)
-        self.audio, self.sr = librosa.load(self.input, mono=True, sr=None)
-        self.song_length_seconds = len(self.audio) / self.sr
+    @staticmethod
+    def grab_fraction(data): # how far into the gesture it was grabbed, 0 = its start, 1 = its end
+        grab = bytes(data.data("application/x-shimi-grab")).decode()
+        return float(grab) if grab else 0.0
                 
     def dragEnterEvent(self, ev) -> None:
         if (isinstance(ev.mimeData().parent(), Library) or isinstance(ev.mimeData().parent(), SequenceView)):
             ev.acceptProposedAction()
 
+    @instruments.timed("sequence.drop")
     def dropEvent(self, ev):
         data = ev.mimeData()
-        instructions = np.frombuffer(data.data("application/octet-stream")).reshape(-1, 4).tolist()
-        danceblock = DanceBlock(name=data.text(), instructions=InstructionSet(instructions), color=data.colorData())     
-        self.dance_length += danceblock.length_accurate()
-        self.setToolTip(f'{self.length_inbeats - self.dance_length} beats left')
-        if self.dance_length <= self.length_inbeats:
-            self.sequence.append(danceblock)
+        moved = self.sequence.find(bytes(data.data("application/x-shimi-gesture-id")).decode())
+        if moved is not None and data.parent() is self:
+            start = self.beat_at(ev.position().x(), self.grab_fraction(data) * moved.length)
+            if self.sequence.fits(start, moved.length, ignore=moved.id):
+                self.sequence.move(moved.id, start)
+                self.populate_layout()
+            else:
+                self.no_room_dialog(start)
+            return
+        danceblock = self.dropped_danceblock(data)
+        start = self.beat_at(ev.position().x(), self.grab_fraction(data) * danceblock.length_accurate())
+        if self.sequence.fits(start, danceblock.length_accurate()):
+            self.sequence.place(danceblock, start)
             self.populate_layout()            
         else:
-            self.dance_length -= danceblock.length_accurate()
-            self.setToolTip(f'{self.length_inbeats - self.dance_length} beats left')
-            dlg = QMessageBox()
-            dlg.setText('Gesture is too long for this section. :/' f'\n ({self.length_inbeats - self.dance_length} beats left)')
-            dlg.setWindowTitle('Error')
-            dlg.exec()
+            self.no_room_dialog(start)
+
+    def dropped_danceblock(self, data): # the sequence keeps its own copy, shared by identical placements
+        source = data.parent()
+        danceblock = source.dances.get(data.text()) if isinstance(source, Library) else None
+        if danceblock is None: # from another segment, which may hold an edited version of the gesture
+            instructions = np.frombuffer(data.data("application/octet-stream")).reshape(-1, 4).tolist()
+            danceblock = DanceBlock(name=data.text(), instructions=InstructionSet(instructions), color=data.colorData())
+        return danceblock
+
+    def no_room_dialog(self, start):
+        dlg = QMessageBox()
+        dlg.setText('Gesture does not fit at beat 'f'{start} of this section. :/' f'\n ({self.sequence.beats_left()} beats left)')
+        dlg.setWindowTitle('Error')
+        dlg.exec()
         
+    @instruments.timed("sequence.populate_layout")
     def populate_layout(self):
-        for i in reversed(range(self.layout().count())):
-            self.layout().itemAt(i).widget().setParent(None)
-        for d in self.sequence:
-            new_gesture = Gesture(d, delete_callback=self.delete_callback, duplicate_callback=self.duplicate_callback)
-            new_gesture.setFixedWidth(self.width_finder(self.width(),new_gesture.danceblock.length_accurate()))
+        while self.layout().count():
+            item = self.layout().takeAt(0)
+            if item.widget() is not None:
+                item.widget().setParent(None)
+        x = 0
+        for p in self.sequence.placements():
+            x0 = self.width_finder(self.width(), p.start)
+            x1 = self.width_finder(self.width(), p.end)
+            if x0 > x:
+                self.layout().addSpacing(x0 - x)
+            new_gesture = Gesture(self.sequence.dance(p), delete_callback=self.delete_callback, duplicate_callback=self.duplicate_callback,
+                                  resize_callback=self.resize_callback, length=p.length, placement_id=p.id,
+                                  edit_callback=self.edit_callback)
+            new_gesture.setFixedWidth(x1 - max(x0, x))
             self.layout().addWidget(new_gesture)
+            x = x1
+        self.update_tooltip()
         
-    def delete_callback(self, ev, danceblock_ref: DanceBlock):
-        self.dance_length -= danceblock_ref.length_accurate()
-        self.setToolTip(f'{self.length_inbeats - self.dance_length} beats left')
-        self.sequence.remove(danceblock_ref)
+    def delete_callback(self, ev, placement_id: int):
+        self.sequence.remove(placement_id)
         self.populate_layout()
 
-    def duplicate_callback(self, ev, danceblock_ref: DanceBlock):
-        duplicate_textbox = QLineEdit()
-        # validator = QIntValidator(0,100,self)
-        # duplicate_textbox.setValidator(validator)
-        duplicate_textbox.setWindowFlag(QtCore.Qt.WindowType.FramelessWindowHint)
+    def duplicate_callback(self, ev, placement_id: int):
+        placement = self.sequence.placement(placement_id)
+        start = self.sequence.first_fit(placement.length, at=placement.end)
+        if start is None:
+            dlg = QMessageBox()
+            dlg.setText('Gesture is too long for this section. :/')
+            dlg.exec()
+            return
+        self.sequence.place(self.sequence.dance(placement), start, placement.length)
+        self.populate_layout()
 
-        ok_btn = QPushButton(text = 'Ok')
-        ok_btn.clicked.connect(self.handle_ok)
-        duplicate_textbox.show()
-        for i in (np.arange(times)+1):
-            self.dance_length += danceblock_ref.length_accurate()
-            if self.dance_length <= self.length_inbeats:
-                self.sequence.append(danceblock)
-                self.populate_layout()            
-            else:
-                self.dance_length -= danceblock.length_accurate()
-                self.setToolTip(f'{self.length_inbeats - self.dance_length} beats left')
-                dlg = QMessageBox()
-                dlg.setText('Gesture is too long for this section. :/')
-                dlg.exec()
-                self.setToolTip(f'{self.length_inbeats - self.dance_length} beats left')
+    def edit_callback(self, placement_id: int, instructions: InstructionSet):
+        self.sequence.edit(placement_id, instructions)
+        self.populate_layout()
+
+    def resize_callback(self, ev, placement_id: int):
+        placement = self.sequence.placement(placement_id)
+        length, ok = QInputDialog.getDouble(self, 'Resize', 'Length (beats):', placement.length,
+                                            self.sequence.resolution, self.length_inbeats, 1)
+        if not ok:
+            return
+        if self.sequence.fits(placement.start, self.sequence.quantize(length), ignore=placement_id):
+            self.sequence.resize(placement_id, length)
+            self.populate_layout()
+        else:
+            self.no_room_dialog(placement.start)
 
     def handle_ok(self):
         self.close()
@@ -291,12 +343,13 @@ class  SequenceView(QWidget):
         return(final_width)
 
 class SequenceLayout(QWidget): # handles the layout of multiple SequenceViews in 1 widget
-    def __init__(self,json_path,sequence_width):
+    def __init__(self,json_path,sequence_width,analysis: Analysis):
         super().__init__()
         self.json_path = json_path
-        self.input = self.json_path[:-5] + '.wav'
         self.width = sequence_width
-        segmentation_closest_beats,self.indexes = json_handling.segmentation_beats(self.json_path)
+        self.analysis = analysis
+        self.tempo_map = analysis.tempo_map
+        self.indexes = analysis.segmentation_indexes
         widths_array_beats = []
         for i in np.arange(1,len(self.indexes)):
             widths_array_beats = np.append(widths_array_beats,self.indexes[i]-self.indexes[i-1])
@@ -304,11 +357,10 @@ class SequenceLayout(QWidget): # handles the layout of multiple SequenceViews in
         self.sequence_layout.setContentsMargins(0, 0, 0, 0)
         self.sequence_layout.setSpacing(0)
         positions, widths = self.find_seq_positions()
-        self.sequence_array = []
-        for i in np.arange(len(positions)):
-           self.sequence_array = np.append(self.sequence_array, SequenceView(self.json_path,widths_array_beats[i]))
-        for i in np.arange(len(self.sequence_array)):
-            self.sequence_layout.addWidget(self.sequence_array[i])
+        self.composition = Composition(widths_array_beats[:len(positions)])
+        self.sequence_array = [SequenceView(self.json_path, segment.length_inbeats, segment) for segment in self.composition]
+        for sequence_view in self.sequence_array:
+            self.sequence_layout.addWidget(sequence_view)
         self.index = 0
         self.setLayout(self.sequence_layout)
 
@@ -325,11 +377,8 @@ class SequenceLayout(QWidget): # handles the layout of multiple SequenceViews in
         self.sequence_layout.setCurrentIndex(self.index)
 
     def find_seq_positions(self):
-        audio, sr = librosa.load(self.input, mono=True, sr=None)
-        audio_length = len(audio)
-        segments = [int(i * sr) for i in json_handling.segmentation(self.json_path)]
-        percentages = np.asarray(segments)/audio_length
-        positions = [int(j * self.width) for j in percentages[0:len(percentages)-1]]
+        segments = self.analysis.segmentation
+        positions = self.tempo_map.seconds_to_pixels(segments[0:len(segments)-1], self.width).astype(int).tolist()
         widths = []
         for i in np.arange(1,len(positions)):
             widths = np.append(widths,positions[i]-positions[i-1])
@@ -337,36 +386,21 @@ class SequenceLayout(QWidget): # handles the layout of multiple SequenceViews in
         return positions, widths
 
     def play_dances(self):
-        dance_names = []
-        start_beats = []
-        gesture_lengths = []
-        for i in np.arange(len(self.sequence_array)):
-            sequence_length = len(self.sequence_array[i].sequence.dances)
-            number = 0
-            for j in np.arange(sequence_length):
-                dance_names = np.append(dance_names,self.sequence_array[i].sequence.dances[j].name.splitlines()[0])
-                gesture_lengths = np.append(gesture_lengths,number)
-                start_beats = np.append(start_beats,self.indexes[i])
-                number += self.sequence_array[i].sequence.dances[j].length_accurate()
-        start_beats += gesture_lengths
-        final_list = [[dance_names[i], start_beats[i]] for i in np.arange(len(dance_names))]
-        # print(final_list)
-        return final_list           
+        return self.composition.dances(self.indexes)
+
+    def compile_timeline(self): # every motor instruction as [motor, beat, position, length, start (s), duration (s)]
+        timeline = self.composition.timeline(self.indexes) # beats follow the song's beat grid, so the seconds come from the tempo map
+        starts = self.tempo_map.beats_to_seconds(timeline[:, 1])
+        durations = self.tempo_map.beat_span_seconds(timeline[:, 1], timeline[:, 3])
+        return np.column_stack([timeline, starts, durations])
 
     def delete_all_dances(self):
-        for sequence_view in self.sequence_array:
-            for each_dance in sequence_view.sequence.dances:
-                sequence_view.dance_length = 0.0
-                sequence_view.sequence.remove(each_dance)
-                sequence_view.populate_layout() 
-                sequence_view.setToolTip(f'{sequence_view.length_inbeats - sequence_view.dance_length} beats left')
+        for i in self.composition.clear(): # only the segments that had gestures need a new layout
+            self.sequence_array[i].populate_layout()
 
     def delete_segment_dances(self):
-        for each_dance in self.sequence_array[self.index].sequence.dances:
-                self.sequence_array[self.index].dance_length = 0.0
-                self.sequence_array[self.index].sequence.remove(each_dance)
-                self.sequence_array[self.index].populate_layout() 
-                self.sequence_array[self.index].setToolTip(f'{self.sequence_array[self.index].length_inbeats - self.sequence_array[self.index].dance_length} beats left')
+        if self.composition.clear_segment(self.index):
+            self.sequence_array[self.index].populate_layout()
 
     def contextMenuEvent(self, ev) -> None:
         self.menu = QMenu(self)
@@ -424,19 +458,24 @@ class TextEdit(QDialog):
 
 class Gesture(QLabel):
     ok_signal = pyqtSignal()
-    def __init__(self, danceblock: DanceBlock, delete_callback=None, duplicate_callback = None):
+    def __init__(self, danceblock: DanceBlock, delete_callback=None, duplicate_callback = None, resize_callback=None, length=None,
+                 placement_id=None, edit_callback=None):
         super().__init__(danceblock.name)
-        self.setText(danceblock.name + f'\n({danceblock.length_accurate()} beats)')
+        self.length = danceblock.length_accurate() if length is None else length
+        self.setText(danceblock.name + f'\n({self.length} beats)')
         self.danceblock = danceblock
+        self.placement_id = placement_id # set for gestures placed in a segment
         self.setFixedHeight(40)
         self.setAlignment(Qt.AlignmentFlag.AlignLeading)
         self.setStyleSheet(f"background-color: {danceblock.color}")
         self.setFrameShape(QFrame.Shape.Box)
         self.setFrameShadow(QFrame.Shadow.Raised)
-        self.setToolTip(f'{danceblock.name}' + f'\n({danceblock.length_accurate()} beats)')
+        self.setToolTip(f'{danceblock.name}' + f'\n({self.length} beats)')
 
         self.delete_callback = delete_callback
         self.duplicate_callback = duplicate_callback
+        self.resize_callback = resize_callback
+        self.edit_callback = edit_callback
 
     def mouseDoubleClickEvent(self, ev: typing.Optional[QtGui.QMouseEvent]):
         self.launch_popup(self.text())
@@ -448,12 +487,19 @@ class Gesture(QLabel):
             mime_data.setText(self.danceblock.name)
             mime_data.setData("application/octet-stream", self.danceblock.instructions.tobytes())
             mime_data.setColorData(self.danceblock.color)
+            if self.placement_id is not None:
+                mime_data.setData("application/x-shimi-gesture-id", str(self.placement_id).encode())
+            mime_data.setData("application/x-shimi-grab", f"{ev.position().x() / max(self.width(), 1):.6f}".encode())
             mime_data.setParent(self.parent())
             drag.setMimeData(mime_data)
             Qt.DropAction.dropAction = drag.exec()
 
     def launch_popup(self, name):
-        pop = TextEdit(name, self, content=self.danceblock.instructions, callback=self.text_callback)
+        if self.placement_id is not None: # placed gestures are edited on a copy, so the library and other placements keep theirs
+            content = InstructionSet([list(row) for row in self.danceblock.instructions.instructions])
+            pop = TextEdit(name, self, content=content, callback=lambda name, instructions: self.edit_callback(self.placement_id, instructions))
+        else:
+            pop = TextEdit(name, self, content=self.danceblock.instructions, callback=self.text_callback)
         pop.show()
 
     def text_callback(self, name, instruction: InstructionSet):
@@ -482,10 +528,13 @@ class Gesture(QLabel):
         if isinstance(self.parent(),SequenceView):
             self.menu = QMenu(self)
             delete_action = QtGui.QAction('Delete', self)
-            delete_action.triggered.connect(lambda: self.delete_callback(ev, self.danceblock))
+            delete_action.triggered.connect(lambda: self.delete_callback(ev, self.placement_id))
             duplicate_action = QtGui.QAction('Duplicate', self)
-            duplicate_action.triggered.connect(lambda: self.duplicate_callback(ev, self.danceblock))
+            duplicate_action.triggered.connect(lambda: self.duplicate_callback(ev, self.placement_id))
+            resize_action = QtGui.QAction('Resize', self)
+            resize_action.triggered.connect(lambda: self.resize_callback(ev, self.placement_id))
             # self.menu.addAction(duplicate_action)
+            self.menu.addAction(resize_action)
             self.menu.addAction(delete_action)
             self.menu.popup(QtGui.QCursor.pos())
 
@@ -511,8 +560,12 @@ class Library(QWidget):
         self.new_gesture_btn.clicked.connect(lambda: self.launch_popup())
         self.reload_gestures_btn = QPushButton(text = 'Reload Gestures')
         self.reload_gestures_btn.clicked.connect(self.reload_dances)
+        self.generate_btn = QPushButton(text = 'Generate Variations')
+        self.generate_btn.setToolTip('Adds mirrored, stretched, quantized and chained versions of every gesture.')
+        self.generate_btn.clicked.connect(self.generate_variations)
         layout.addWidget(self.new_gesture_btn, 0)
         layout.addWidget(self.reload_gestures_btn,0)       
+        layout.addWidget(self.generate_btn,0)
 
         self.dances_layout = QVBoxLayout()
         self.dances_layout.setContentsMargins(0, 0, 0, 0)
@@ -540,10 +593,17 @@ class Library(QWidget):
         os.remove(os.path.join(self.dances_csv_path, f"{danceblock_ref.name}.csv"))
         self.reload_dances()
 
+    @instruments.timed("library.reload")
     def reload_dances(self):
         self.dances = self.load_danceblock(self.dances_csv_path)
         self.populate_dances()
 
+    def generate_variations(self):
+        batch = gesture_tools.GestureBatch.from_instructions(
+            (name, d.instructions.instructions) for name, d in self.dances.items())
+        gesture_tools.write_library(gesture_tools.generate(batch), self.dances_csv_path)
+        self.reload_dances()
+
     def launch_popup(self, name="Untitled"):
         pop = TextEdit(name, self, content=None, callback=self.text_callback)
         pop.show()
@@ -553,25 +613,75 @@ class Library(QWidget):
         self.new_gesture_signal.emit(d)
       
 
+class DiagnosticsPanel(QWidget): # live view of the instrumentation timers, plus event loop stall tracking
+    def __init__(self, interval_ms=1000, heartbeat_ms=20, stall_ms=100):
+        super().__init__()
+        self.setWindowTitle("Diagnostics")
+        self.text = QLabel()
+        self.text.setFont(QtGui.QFontDatabase.systemFont(QtGui.QFontDatabase.SystemFont.FixedFont))
+        self.text.setAlignment(Qt.AlignmentFlag.AlignTop | Qt.AlignmentFlag.AlignLeft)
+        self.text.setTextInteractionFlags(Qt.TextInteractionFlag.TextSelectableByMouse)
+        reset_btn = QPushButton(text="Reset")
+        reset_btn.clicked.connect(instruments.reset)
+        layout = QVBoxLayout()
+        layout.addWidget(self.text, 1)
+        layout.addWidget(reset_btn, 0)
+        self.setLayout(layout)
+
+        # a timer that should fire every heartbeat_ms: anything later than that was time the GUI thread was busy
+        self.heartbeat_ms = heartbeat_ms
+        self.stall_ms = stall_ms
+        self.last_beat = time.perf_counter()
+        self.heartbeat = QtCore.QTimer(self)
+        self.heartbeat.timeout.connect(self.heartbeat_callback)
+        self.heartbeat.start(heartbeat_ms)
+
+        self.refresh_timer = QtCore.QTimer(self)
+        self.refresh_timer.timeout.connect(self.refresh)
+        self.refresh_timer.start(interval_ms)
+
+    def heartbeat_callback(self):
+        now = time.perf_counter()
+        lag = now - self.last_beat - self.heartbeat_ms / 1000
+        self.last_beat = now
+        instruments.record("gui.event_loop_lag", max(lag, 0.0))
+        if lag * 1000 > self.stall_ms:
+            instruments.count("gui.stalls")
+
+    def refresh(self):
+        if not self.isVisible():
+            return
+        snapshot = instruments.snapshot()
+        lines = [f"{'timer':28s} {'count':>8s} {'mean ms':>9s} {'p99 ms':>9s} {'max ms':>9s}"]
+        for name, stat in snapshot["timers"].items():
+            lines.append(f"{name:28s} {stat['count']:8d} {stat['mean_s'] * 1e3:9.3f} {stat['p99_s'] * 1e3:9.3f} {stat['max_s'] * 1e3:9.3f}")
+        lines.append("")
+        for name, value in sorted(snapshot["counters"].items()):
+            lines.append(f"{name:28s} {value:8d}")
+        self.text.setText("\n".join(lines))
+
+
 # Canvas = WaveformView + SequenceView + TransportBar
 
 class Canvas(QWidget):
-    def __init__(self,json_path):
+    def __init__(self, session: Session, song: Song):
         super().__init__()
-        self.json_path = json_path
-        self.input = self.json_path[:-5] + '.wav'
-        audio, sr = librosa.load(self.input, mono=True, sr=None)
-        tempo = json_handling.tempo(self.json_path)
+        self.session = session
+        self.song = song
+        self.json_path = song.json_path
+        analysis = session.analysis(song)
+        self.total_time = analysis.song_length
+        self.tempo_map = analysis.tempo_map
+        self.segment_cursor = SegmentCursor(analysis.segmentation[:-1], self.total_time)
+        self.segment_cursor.resize(self.width())
         self.waveform_view = WaveformView(self.json_path,mouse_press_callback=self.mouse_callback)
-        self.waveform_view.render(audio, kernel=127)
-        
+        self.waveform_view.length = 0
+        self.waveform_view.segmentation = analysis.segmentation
 
         self.transport = TransportBar(self.json_path)
-        self.transport.set_audio(audio, sr)
-        self.transport.set_tempo(tempo)
-        self.total_time = len(audio) / sr
+        self.transport.set_tempo(self.tempo_map)
 
-        self.sequence_layout = SequenceLayout(self.json_path,self.waveform_view.width())
+        self.sequence_layout = SequenceLayout(self.json_path,self.waveform_view.width(),analysis)
 
         # ----------- prev/next segment buttons and segment labels -------------
         self.seg_lbl = QPushButton(text = 'Segment 'f'{self.sequence_layout.index}')
@@ -638,44 +748,56 @@ class Canvas(QWidget):
         # self.seq_playhead.setFixedHeight(int(self.sequence_layout.height()-next_btn.height()))
         # self.seq_playhead.setStyleSheet("background-color: red")
 
-        audio, sr = librosa.load(self.input, mono=True, sr=None)
-        self.song_length = len(audio)/sr
+        self.song_length = self.total_time
 
     def position_callback(self, position):
         self.playhead.move(int(self.width() * position / self.total_time), 0)
-
-        new_position = json_handling.mouse_quantizetobeats(self.json_path, position, self.song_length, self.width())
-        positions = json_handling.segmentation_positions(self.json_path,self.song_length, self.width())
-        jump_index = (np.abs(positions - positions[positions < position].max())).argmin()
-        self.sequence_layout.index = jump_index
-        self.sequence_layout.sequence_layout.setCurrentIndex(self.sequence_layout.index)
-        self.lbl_text()
+        if self.segment_cursor.advance(position):
+            self.show_segment(self.segment_cursor.index)
     
     def mouse_callback(self, position):
-        new_position = json_handling.mouse_quantizetobeats(self.json_path, position, self.song_length, self.width())
-        positions = json_handling.segmentation_positions(self.json_path,self.song_length, self.width())
-        jump_index = (np.abs(positions - positions[positions < position].max())).argmin()
-        
-        self.sequence_layout.index = jump_index
-        self.sequence_layout.sequence_layout.setCurrentIndex(self.sequence_layout.index)
-        self.lbl_text()
+        new_position = self.tempo_map.quantize_pixels(position, self.width())
+        if self.segment_cursor.seek_pixels(position):
+            self.show_segment(self.segment_cursor.index)
         self.playhead.move(int(new_position), 0)
         self.transport.seek(new_position / self.width())
 
-        subtracted_position = new_position-positions[positions < position].max()
-        positions,widths = self.sequence_layout.find_seq_positions()
-        percentage = subtracted_position/ widths[jump_index]
-        seq_mouse_position = percentage*self.sequence_layout.width
-        # self.seq_playhead.move(int(seq_mouse_position),int(self.waveform_view.height()))
-
     def segment_callback(self):
-        positions = json_handling.segmentation_positions(self.json_path,self.song_length, self.width())
-        self.playhead.move(int(positions[self.sequence_layout.index]), 0)
-        self.transport.seek(positions[self.sequence_layout.index] / self.width())
+        self.segment_cursor.set_index(self.sequence_layout.index)
+        position = self.segment_cursor.start_pixels()
+        self.playhead.move(int(position), 0)
+        self.transport.seek(position / self.width())
         # self.seq_playhead.move(0,int(self.waveform_view.height()))
 
+    def show_segment(self, index):
+        self.sequence_layout.index = index
+        self.sequence_layout.sequence_layout.setCurrentIndex(index)
+        self.lbl_text()
+
+    def resume(self): # takes the audio and waveform back from the session cache (rebuilt if they were evicted)
+        audio = self.session.audio(self.song)
+        self.transport.set_audio(audio, audio.sr)
+        if not self.waveform_view.length:
+            self.show_waveform()
+
+    def show_waveform(self): # the pyramid level that suits the current width
+        peaks, kernel = self.session.waveform_for_width(self.song, max(self.waveform_view.width(), 1))
+        if kernel != self.waveform_view.kernel or not self.waveform_view.length:
+            self.waveform_view.show_waveform(peaks, self.session.audio(self.song).sr, kernel)
+
+    def suspend(self): # lets go of the audio and waveform while the song isn't on screen
+        if self.transport.is_playing:
+            self.transport.pause()
+        self.transport.audio = None
+        self.waveform_view.clear()
+        self.waveform_view.length = 0
+
+    @instruments.timed("canvas.resize")
     def resizeEvent(self, a0):
         self.playhead.setFixedHeight(int(self.waveform_view.height()))
+        self.segment_cursor.resize(a0.size().width())
+        if self.waveform_view.length: # a coarser or finer level may suit the new width
+            self.show_waveform()
         for i in self.sequence_layout.sequence_array:
             i.reload_dances()
         QWidget.resizeEvent(self, a0)
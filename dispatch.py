@@ -0,0 +1,236 @@
+import sys
+import json
+import time
+import asyncio
+import argparse
+import threading
+from instrumentation import instruments
+
+# sends a compiled choreography to any number of Shimi robots at once
+# every robot speaks newline-delimited json over tcp:
+#   -> {"type": "ping", "t0": ...}                <- {"type": "pong", "t0": ..., "t1": ..., "t2": ...}
+#   -> {"type": "dance", ...}                     <- {"type": "ack", "ok": true}
+#   -> {"type": "start", "start_at": ...}         <- {"type": "ack", "ok": true}
+# the pings estimate each robot's clock offset, so "start_at" is given in the robot's own clock
+# and every robot starts at the same moment; the start is only scheduled once every robot has
+# acknowledged its dance, so a slow dance upload can't push a robot past its start time
+
+DEFAULT_PORT = 12345
+
+
+class RobotTarget:
+    def __init__(self, host, port=DEFAULT_PORT, name=None, motor_remap: dict = None, variant: dict = None):
+        self.host = host
+        self.port = port
+        self.name = f"{host}:{port}" if name is None else name
+        self.motor_remap = motor_remap # {motor id in the composition: motor id on this robot}
+        self.variant = variant # keys that replace the shared choreography for this robot only
+
+    def payload(self, choreography: dict):
+        payload = dict(choreography)
+        if self.variant:
+            payload.update(self.variant)
+        if self.motor_remap and "timeline" in payload:
+            payload["timeline"] = [[self.motor_remap.get(int(row[0]), row[0])] + list(row[1:]) for row in payload["timeline"]]
+        return payload
+
+
+class DispatchResult:
+    def __init__(self, target: RobotTarget):
+        self.target = target
+        self.ok = False
+        self.error = None
+        self.offset = None # robot clock - our clock, seconds
+        self.round_trip = None # best ping round trip, seconds
+        self.start_at = None # start time in the robot's clock
+        self.ack_latency = None # dance sent -> ack received, seconds
+
+    def __repr__(self):
+        status = "ok" if self.ok else f"failed ({self.error})"
+        return f"<{self.target.name}: {status}>"
+
+
+def targets_from_string(text): # "host[:port],host[:port],..." as used by SHIMI_ROBOTS
+    targets = []
+    for item in text.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        host, _, port = item.rpartition(':') if ':' in item else (item, '', '')
+        targets.append(RobotTarget(host, int(port) if port else DEFAULT_PORT))
+    return targets
+
+
+async def send_message(writer, message):
+    writer.write(json.dumps(message).encode() + b'\n')
+    await writer.drain()
+
+
+async def read_message(reader):
+    line = await reader.readline()
+    if not line:
+        raise ConnectionError("connection closed by robot")
+    return json.loads(line)
+
+
+class Dispatcher:
+    def __init__(self, timeout=2.0, pings=5, lead_time=0.5, max_connections=64):
+        self.timeout = timeout
+        self.pings = pings
+        self.lead_time = lead_time # how far ahead of "now" the synchronized start is scheduled, on top of the slowest round trip
+        self.max_connections = max_connections
+
+    async def connect(self, target: RobotTarget, result: DispatchResult, semaphore):
+        async with semaphore:
+            reader, writer = await asyncio.wait_for(asyncio.open_connection(target.host, target.port), self.timeout)
+            try:
+                best = None
+                for _ in range(self.pings): # keep the offset measured over the fastest round trip
+                    t0 = time.time()
+                    await send_message(writer, {"type": "ping", "t0": t0})
+                    pong = await asyncio.wait_for(read_message(reader), self.timeout)
+                    t3 = time.time()
+                    round_trip = (t3 - t0) - (pong["t2"] - pong["t1"])
+                    if best is None or round_trip < best[0]:
+                        best = (round_trip, ((pong["t1"] - t0) + (pong["t2"] - t3)) / 2)
+            except BaseException:
+                writer.close()
+                raise
+            result.round_trip, result.offset = best
+            return reader, writer
+
+    async def deliver(self, connection, message, result: DispatchResult): # one message, then the robot's ack
+        reader, writer = connection
+        sent = time.perf_counter()
+        await send_message(writer, message)
+        ack = await asyncio.wait_for(read_message(reader), self.timeout)
+        if ack.get("type") != "ack" or not ack.get("ok", False):
+            result.error = ack.get("error", f"robot refused the {message['type']}")
+        return time.perf_counter() - sent
+
+    async def deliver_all(self, messages: dict, results): # {result: (connection, message)}, returns the ack latencies
+        outcomes = await asyncio.gather(*[self.deliver(c, m, r) for r, (c, m) in messages.items()], return_exceptions=True)
+        for result, outcome in zip(messages, outcomes):
+            if isinstance(outcome, BaseException):
+                result.error = repr(outcome)
+        return dict(zip(messages, outcomes))
+
+    async def send(self, choreography: dict, targets: list[RobotTarget]) -> list[DispatchResult]:
+        results = [DispatchResult(t) for t in targets]
+        semaphore = asyncio.Semaphore(self.max_connections)
+
+        # 1. connect and measure clock offsets, all robots at once
+        connections = await asyncio.gather(*[self.connect(t, r, semaphore) for t, r in zip(targets, results)],
+                                           return_exceptions=True)
+        for result, connection in zip(results, connections):
+            if isinstance(connection, BaseException):
+                result.error = repr(connection)
+        open_connections = [(r, c) for r, c in zip(results, connections) if r.error is None]
+        try:
+            # 2. upload the dances, however long that takes
+            uploads = {r: (c, dict(r.target.payload(choreography), type="dance")) for r, c in open_connections}
+            for result, latency in (await self.deliver_all(uploads, results)).items():
+                if result.error is None:
+                    result.ack_latency = latency
+                    instruments.record("network.send", latency)
+
+            # 3. one start time for everybody, translated into each robot's clock; only a short message is left to send
+            ready = [(r, c) for r, c in open_connections if r.error is None]
+            start_at = time.time() + self.lead_time + max((r.round_trip for r, _ in ready), default=0.0)
+            starts = {}
+            for result, connection in ready:
+                result.start_at = start_at + result.offset
+                starts[result] = (connection, {"type": "start", "start_at": result.start_at})
+            await self.deliver_all(starts, results)
+        finally:
+            for _, (_, writer) in open_connections:
+                writer.close()
+        for result in results:
+            result.ok = result.error is None
+        instruments.count("network.send_failures", sum(not r.ok for r in results))
+        return results
+
+    def send_blocking(self, choreography, targets):
+        return asyncio.run(self.send(choreography, targets))
+
+    def send_in_background(self, choreography, targets, callback): # callback(results) runs on the worker thread
+        thread = threading.Thread(target=lambda: callback(self.send_blocking(choreography, targets)), daemon=True)
+        thread.start()
+        return thread
+
+
+class StandInRobot: # local stand-in for a robot, for testing the dispatcher without hardware
+    def __init__(self, host='127.0.0.1', port=0, clock_offset=0.0, delay=0.0, refuse=False):
+        self.host = host
+        self.port = port
+        self.clock_offset = clock_offset # pretend our clock is this far off, seconds
+        self.delay = delay # extra latency before every reply
+        self.refuse = refuse
+        self.received = []
+        self.server = None
+
+    def clock(self):
+        return time.time() + self.clock_offset
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    async def close(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    def target(self, **kwargs):
+        return RobotTarget(self.host, self.port, **kwargs)
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                t1 = self.clock()
+                message = json.loads(line)
+                if self.delay:
+                    await asyncio.sleep(self.delay)
+                if message["type"] == "ping":
+                    await send_message(writer, {"type": "pong", "t0": message["t0"], "t1": t1, "t2": self.clock()})
+                elif message["type"] == "dance":
+                    self.received.append(message)
+                    reply = {"type": "ack", "ok": not self.refuse}
+                    if self.refuse:
+                        reply["error"] = "refused"
+                    await send_message(writer, reply)
+                elif message["type"] == "start":
+                    self.received[-1]["start_at"] = message["start_at"]
+                    await send_message(writer, {"type": "ack", "ok": True})
+        finally:
+            writer.close()
+
+
+async def serve(count, port, clock_spread):
+    robots = [await StandInRobot(port=port + i if port else 0, clock_offset=clock_spread * i).start() for i in range(count)]
+    print(",".join(f"{r.host}:{r.port}" for r in robots), flush=True)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        for r in robots:
+            await r.close()
+
+
+def main(argv=None): # python -m dispatch --serve 8   starts 8 stand-in robots and prints their SHIMI_ROBOTS string
+    parser = argparse.ArgumentParser(description="Stand-in Shimi robots for testing the dispatcher")
+    parser.add_argument("--serve", type=int, default=1, help="number of stand-in robots")
+    parser.add_argument("--port", type=int, default=0, help="first port (0 picks free ports)")
+    parser.add_argument("--clock-spread", type=float, default=0.0, help="fake clock offset between robots, seconds")
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(serve(args.serve, args.port, args.clock_spread))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,116 @@
+import io
+import json
+import zipfile
+import numpy as np
+
+# bundles a composition with its song for offline playback on the robot
+# the archive is an uncompressed zip, so every member can be read in place with a seek:
+#   manifest.json    format, sample rate, chunk layout
+#   analysis.json    beats (seconds), segmentation, tempo
+#   dances.json      [gesture name, start beat] pairs, as sent by "Send"
+#   timeline.npy     float64 [motor, beat, position, length, start, duration] rows sorted by beat,
+#                    start and duration in seconds from the song's tempo map
+#   audio/NNNNNN.pcm mono 16-bit little-endian pcm, chunk_frames frames per chunk (the last one may be shorter)
+# the writer streams audio one chunk at a time, so memory use doesn't depend on the song length
+
+FORMAT_VERSION = 1
+CHUNK_FRAMES = 1 << 16
+TIMELINE_COLUMNS = ["motor", "beat", "position", "length", "start", "duration"]
+
+
+def to_pcm16(x):
+    return np.clip(np.round(np.asarray(x) * 32767), -32768, 32767).astype('<i2')
+
+
+def resampled_chunk(audio, source_sr, target_sr, start, frames): # target_sr frames [start, start + frames)
+    ratio = source_sr / target_sr
+    positions = (start + np.arange(frames)) * ratio
+    width = max(int(ratio), 1) # box filter before decimating, a cheap guard against aliasing
+    first = max(int(positions[0]) - width, 0)
+    block = audio.read(first, int(positions[-1]) + width + 2 - first)
+    if width > 1: # trailing average, read back half a window later so it stays centred
+        smoothed = np.cumsum(np.concatenate([[0.0], block]))
+        lo = np.maximum(np.arange(len(block)) - width + 1, 0)
+        block = (smoothed[1:] - smoothed[lo]) / (np.arange(len(block)) + 1 - lo)
+        positions = positions + (width - 1) / 2
+    return np.interp(positions, first + np.arange(len(block)), block)
+
+
+def export_composition(path, song_name, audio, tempo_map, segmentation, dances, timeline, sr=None,
+                       chunk_frames=CHUNK_FRAMES, include_audio=True, progress=None):
+    source_sr = audio.sr
+    sr = source_sr if sr is None else int(sr)
+    frames = int(len(audio) * sr / source_sr) if include_audio else 0
+    chunks = (frames + chunk_frames - 1) // chunk_frames
+    manifest = {
+        "version": FORMAT_VERSION,
+        "song": song_name,
+        "sample_rate": sr,
+        "channels": 1,
+        "sample_format": "pcm_s16le",
+        "frames": frames,
+        "chunk_frames": chunk_frames,
+        "chunks": chunks,
+        "timeline_columns": TIMELINE_COLUMNS,
+    }
+    with zipfile.ZipFile(path, 'w', compression=zipfile.ZIP_STORED, allowZip64=True) as zf:
+        zf.writestr("manifest.json", json.dumps(manifest, indent=2))
+        zf.writestr("analysis.json", json.dumps({
+            "beats": tempo_map.beat_times.tolist(),
+            "tempo": tempo_map.bpm,
+            "segmentation": np.asarray(segmentation, dtype=float).tolist(),
+        }))
+        zf.writestr("dances.json", json.dumps([[name, float(beat)] for name, beat in dances]))
+        buffer = io.BytesIO()
+        np.save(buffer, np.asarray(timeline, dtype=np.float64).reshape(-1, len(TIMELINE_COLUMNS)))
+        zf.writestr("timeline.npy", buffer.getvalue())
+
+        for n in range(chunks):
+            start = n * chunk_frames
+            count = min(chunk_frames, frames - start)
+            if sr == source_sr:
+                x = audio.read(start, count)
+            else:
+                x = resampled_chunk(audio, source_sr, sr, start, count)
+            with zf.open(f"audio/{n:06d}.pcm", 'w', force_zip64=True) as f:
+                f.write(to_pcm16(x).tobytes())
+            if progress is not None:
+                progress((n + 1) / chunks)
+    return manifest
+
+
+class ExportReader: # reads an exported archive the way the robot does, a chunk at a time
+    def __init__(self, path):
+        self.zf = zipfile.ZipFile(path, 'r')
+        self.manifest = json.loads(self.zf.read("manifest.json"))
+        self.sr = self.manifest["sample_rate"]
+        self.chunk_frames = self.manifest["chunk_frames"]
+
+    def close(self):
+        self.zf.close()
+
+    def __len__(self):
+        return self.manifest["frames"]
+
+    def analysis(self):
+        return json.loads(self.zf.read("analysis.json"))
+
+    def dances(self):
+        return json.loads(self.zf.read("dances.json"))
+
+    def timeline(self):
+        return np.load(io.BytesIO(self.zf.read("timeline.npy")))
+
+    def read(self, start, frames): # mono float32 samples [start, start + frames)
+        start = max(int(start), 0)
+        stop = min(start + max(int(frames), 0), len(self))
+        out = []
+        for n in range(start // self.chunk_frames, (stop - 1) // self.chunk_frames + 1 if stop > start else 0):
+            with self.zf.open(f"audio/{n:06d}.pcm") as f:
+                lo = max(start - n * self.chunk_frames, 0)
+                hi = min(stop - n * self.chunk_frames, self.chunk_frames)
+                f.seek(lo * 2)
+                out.append(np.frombuffer(f.read((hi - lo) * 2), dtype='<i2'))
+        if not out:
+            return np.zeros(0, dtype=np.float32)
+        return np.concatenate(out).astype(np.float32) / 32767
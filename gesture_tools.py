@@ -0,0 +1,184 @@
+import os
+import sys
+import glob
+import zlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+# generates families of new gestures from existing ones
+# gestures are held as one padded (gestures, rows, 4) array of [motor, beat, position, length] rows
+# so every transform is a handful of numpy operations over the whole batch;
+# big batches are split across a process pool and the results are written to the library in one go
+
+MOTOR, BEAT, POSITION, LENGTH = range(4)
+
+
+class GestureBatch:
+    def __init__(self, names: list, data: np.ndarray, mask: np.ndarray):
+        assert data.ndim == 3 and data.shape[2] == 4 and mask.shape == data.shape[:2]
+        self.names = list(names)
+        self.data = data
+        self.mask = mask # True for real rows, False for padding
+
+    def __len__(self):
+        return len(self.names)
+
+    @classmethod
+    def from_instructions(cls, gestures): # gestures: iterable of (name, [[motor, beat, position, length], ...])
+        gestures = [(name, np.asarray(rows, dtype=float).reshape(-1, 4)) for name, rows in gestures]
+        rows = max((len(r) for _, r in gestures), default=1)
+        data = np.zeros((len(gestures), rows, 4))
+        mask = np.zeros((len(gestures), rows), dtype=bool)
+        for i, (_, r) in enumerate(gestures):
+            data[i, :len(r)] = r
+            mask[i, :len(r)] = True
+        return cls([name for name, _ in gestures], data, mask)
+
+    @classmethod
+    def from_directory(cls, dances_csv_path): # same files Library.load_danceblock reads
+        gestures = []
+        for f in sorted(glob.glob(os.path.join(dances_csv_path, "*.csv"))):
+            gestures.append((os.path.splitext(os.path.basename(f))[0], np.loadtxt(fname=f, delimiter=',').reshape(-1, 4)))
+        return cls.from_instructions(gestures)
+
+    @classmethod
+    def stack(cls, batches): # one batch out of several, padded to the longest gesture
+        batches = [b for b in batches if len(b)]
+        if not batches:
+            return cls([], np.zeros((0, 1, 4)), np.zeros((0, 1), dtype=bool))
+        rows = max(b.data.shape[1] for b in batches)
+        data = np.concatenate([np.pad(b.data, ((0, 0), (0, rows - b.data.shape[1]), (0, 0))) for b in batches])
+        mask = np.concatenate([np.pad(b.mask, ((0, 0), (0, rows - b.mask.shape[1]))) for b in batches])
+        return cls([n for b in batches for n in b.names], data, mask)
+
+    def __getitem__(self, index): # slice or index array over the gestures
+        names = [self.names[i] for i in np.arange(len(self.names))[index]]
+        return GestureBatch(names, self.data[index], self.mask[index])
+
+    def instructions(self): # back to (name, rows) pairs, rows sorted by beat
+        out = []
+        for i, name in enumerate(self.names):
+            rows = self.data[i][self.mask[i]]
+            out.append((name, rows[np.argsort(rows[:, BEAT], kind='stable')].tolist()))
+        return out
+
+    def lengths(self): # beats from the start to the end of the last instruction, like DanceBlock.length_accurate
+        return np.where(self.mask, self.data[..., BEAT] + self.data[..., LENGTH], 0).max(axis=1)
+
+    def _derive(self, suffix, data, mask=None):
+        return GestureBatch([f"{n}{suffix}" for n in self.names], data, self.mask if mask is None else mask)
+
+    def time_stretch(self, beats): # every gesture rescaled to last exactly `beats` beats
+        data = self.data.copy()
+        factor = beats / np.maximum(self.lengths(), 1e-9)
+        data[..., BEAT] *= factor[:, None]
+        data[..., LENGTH] *= factor[:, None]
+        return self._derive(f"_{beats:g}beats", data)
+
+    def mirror(self, low=0.0, high=1.0): # positions flipped inside [low, high]
+        data = self.data.copy()
+        data[..., POSITION] = np.where(self.mask, low + high - data[..., POSITION], 0)
+        return self._derive("_mirror", data)
+
+    def retarget(self, mapping: dict, suffix="_retarget"): # motor ids replaced, e.g. {2: 3, 3: 2}
+        data = self.data.copy()
+        motors = data[..., MOTOR].astype(int)
+        lut = np.arange(max([motors.max(initial=0), *mapping.keys(), *mapping.values()]) + 1)
+        for old, new in mapping.items():
+            lut[old] = new
+        data[..., MOTOR] = np.where(self.mask, lut[motors], 0)
+        return self._derive(suffix, data)
+
+    def quantize(self, step=0.5): # starts snapped to the grid, lengths to at least one step
+        data = self.data.copy()
+        data[..., BEAT] = np.round(data[..., BEAT] / step) * step
+        data[..., LENGTH] = np.maximum(np.round(data[..., LENGTH] / step), 1) * step
+        return self._derive(f"_q{step:g}", data)
+
+    def concatenate(self, other: "GestureBatch"): # gesture i of self followed by gesture i of other
+        assert len(self) == len(other)
+        shifted = other.data.copy()
+        shifted[..., BEAT] += self.lengths()[:, None]
+        return GestureBatch([f"{a}+{b}" for a, b in zip(self.names, other.names)],
+                            np.concatenate([self.data, shifted], axis=1), np.concatenate([self.mask, other.mask], axis=1))
+
+
+# recipes are lists of (method, kwargs) applied in order; the defaults make a family per gesture
+DEFAULT_RECIPES = [
+    [("mirror", {})],
+    [("quantize", {"step": 0.5})],
+    [("time_stretch", {"beats": 2})],
+    [("time_stretch", {"beats": 4})],
+    [("time_stretch", {"beats": 8})],
+    [("mirror", {}), ("time_stretch", {"beats": 4})],
+    [("concatenate", {})], # with the next gesture in the batch (the last one wraps around to the first)
+]
+
+
+def apply_recipe(batch: GestureBatch, recipe):
+    for method, kwargs in recipe:
+        if method == "concatenate":
+            batch = batch.concatenate(batch[np.roll(np.arange(len(batch)), -1)])
+        else:
+            batch = getattr(batch, method)(**kwargs)
+    return batch
+
+
+def _apply_recipes(args): # process pool worker, keeps the first `keep` gestures of every result
+    names, data, mask, recipes, keep = args
+    batch = GestureBatch(names, data, mask)
+    return [apply_recipe(batch, recipe)[:keep] for recipe in recipes]
+
+
+def generate(batch: GestureBatch, recipes=DEFAULT_RECIPES, processes=None, chunk_size=4096):
+    if len(batch) <= chunk_size or processes == 1:
+        return GestureBatch.stack(_apply_recipes((batch.names, batch.data, batch.mask, recipes, len(batch))))
+    # every "concatenate" reaches one gesture further ahead, so each chunk carries that many of the gestures
+    # after it (wrapping around like the serial path) and drops them again; results don't depend on chunk_size
+    halo = max(sum(method == "concatenate" for method, _ in recipe) for recipe in recipes)
+    chunks = []
+    for i in range(0, len(batch), chunk_size):
+        keep = min(chunk_size, len(batch) - i)
+        window = np.arange(i, i + keep + halo) % len(batch)
+        chunks.append(([batch.names[j] for j in window], batch.data[window], batch.mask[window], recipes, keep))
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        results = list(pool.map(_apply_recipes, chunks))
+    return GestureBatch.stack([r[i] for i in range(len(recipes)) for r in results]) # same order as the serial path
+
+
+def write_library(batch: GestureBatch, dances_csv_path, overwrite=False): # one csv per gesture, returns the names written
+    os.makedirs(dances_csv_path, exist_ok=True)
+    written = []
+    for name, rows in batch.instructions():
+        if len(name) > 120: # names grow with every round of recipes
+            name = f"{name[:100]}_{zlib.crc32(name.encode()):08x}"
+        path = os.path.join(dances_csv_path, f"{name}.csv")
+        if not overwrite and os.path.exists(path):
+            continue
+        with open(path, 'w') as f:
+            f.write('\n'.join(','.join(f"{v:g}" for v in row) for row in rows))
+        written.append(name)
+    return written
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate gesture variations from a gesture library")
+    parser.add_argument("source", nargs='?', default="gestures", help="folder of gesture csv files")
+    parser.add_argument("--out", default=None, help="where to write the new gestures (default: the source folder)")
+    parser.add_argument("--processes", type=int, default=None, help="worker processes (default: one per cpu)")
+    parser.add_argument("--rounds", type=int, default=1, help="apply the recipes again to the previous round's output")
+    args = parser.parse_args(argv)
+
+    batch = GestureBatch.from_directory(args.source)
+    generated = []
+    for _ in range(args.rounds):
+        batch = generate(batch, processes=args.processes)
+        generated.append(batch)
+    written = write_library(GestureBatch.stack(generated), args.out or args.source)
+    print(f"wrote {len(written)} gestures to {args.out or args.source}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,126 @@
+import os
+import json
+import functools
+import time
+import threading
+import numpy as np
+
+# low-overhead timers and counters for finding where time goes
+# disabled unless SHIMI_DIAGNOSTICS=1 (or --diagnostics), in which case timer() hands
+# back one shared no-op context manager and count() returns straight away
+
+# histogram bucket upper edges in seconds: 10us ... ~10s, doubling
+BUCKETS = 1e-5 * 2.0 ** np.arange(21)
+
+
+class Stat: # running totals and a log-bucket histogram for one timer
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.last = 0.0
+        self.histogram = np.zeros(len(BUCKETS) + 1, dtype=np.int64)
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.last = seconds
+        if seconds > self.max:
+            self.max = seconds
+        self.histogram[np.searchsorted(BUCKETS, seconds)] += 1
+
+    def percentile(self, q): # upper bucket edge under which q% of the samples fall
+        if not self.count:
+            return 0.0
+        i = np.searchsorted(np.cumsum(self.histogram), self.count * q / 100)
+        return min(float(BUCKETS[i]), self.max) if i < len(BUCKETS) else self.max
+
+    def to_dict(self):
+        return {"count": self.count, "total_s": self.total, "mean_s": self.total / self.count if self.count else 0.0,
+                "max_s": self.max, "last_s": self.last, "p50_s": self.percentile(50), "p99_s": self.percentile(99),
+                "histogram": {f"<={edge:.1e}" if i < len(BUCKETS) else f">{BUCKETS[-1]:.1e}": int(n)
+                              for i, (edge, n) in enumerate(zip(np.append(BUCKETS, np.inf), self.histogram)) if n}}
+
+
+class _Timer:
+    __slots__ = ("stat", "start")
+
+    def __init__(self, stat):
+        self.stat = stat
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.stat.add(time.perf_counter() - self.start)
+        return False
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NULL_TIMER = _NullTimer()
+
+
+class Instruments:
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.stats: dict[str, Stat] = {}
+        self.counters: dict[str, int] = {}
+        self.lock = threading.Lock() # the audio callback runs on pyaudio's thread
+        self.started = time.time()
+
+    def timer(self, name): # with instruments.timer("audio.callback"): ...
+        if not self.enabled:
+            return NULL_TIMER
+        stat = self.stats.get(name)
+        if stat is None:
+            with self.lock:
+                stat = self.stats.setdefault(name, Stat())
+        return _Timer(stat)
+
+    def timed(self, name): # decorator form of timer()
+        def decorator(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return fn(*args, **kwargs)
+                with self.timer(name):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def record(self, name, seconds): # for durations measured elsewhere
+        if self.enabled:
+            with self.lock:
+                self.stats.setdefault(name, Stat()).add(seconds)
+
+    def count(self, name, n=1):
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def reset(self):
+        with self.lock:
+            self.stats.clear()
+            self.counters.clear()
+            self.started = time.time()
+
+    def snapshot(self):
+        with self.lock:
+            return {"started": self.started, "time": time.time(), "counters": dict(self.counters),
+                    "timers": {name: stat.to_dict() for name, stat in sorted(self.stats.items())}}
+
+    def dump(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.snapshot(), f, indent=2)
+
+
+instruments = Instruments(enabled=os.environ.get("SHIMI_DIAGNOSTICS", "") not in ("", "0"))
@@ -1,17 +1,15 @@
+import bisect
+import math
+import itertools
 import numpy as np
 import random
 import uuid
 from PyQt6.QtCore import QAbstractTableModel, QModelIndex, Qt
 import os
 import csv
-import librosa
-import json_handling
 
 # handles all non-display elements
 
-input = 'Closer.wav'
-path = 'Closer.json'
-
 class InstructionSet(QAbstractTableModel): # handles the csv for each gesture that contains instructions
     def __init__(self, instructions: list):
         super().__init__()
@@ -68,11 +66,6 @@ class DanceBlock(BaseBlock):
                                      random.randrange(*color_range)) if color is None else color
         super(DanceBlock, self).__init__(name=name)
 
-        self.tempo = json_handling.tempo(path)
-        self.audio, self.sr = librosa.load(input, mono=True, sr=None)
-        self.song_length_seconds = len(self.audio) / self.sr
-        self.display_width = self.width_finder(700)
-
     def length(self):
         length_array = []
         last_row_idx = self.instructions.rowCount()
@@ -87,12 +80,6 @@ class DanceBlock(BaseBlock):
             lengths_array = np.append(lengths_array, self.instructions.instructions[i][1]+self.instructions.instructions[i][3])
         return max(lengths_array)
 
-    def width_finder(self,width):
-        beats_to_seconds = self.length_accurate() / self.tempo * 60
-        percentage = beats_to_seconds/self.song_length_seconds
-        final_width = int(percentage*width)
-        return(final_width)
-
     def __len__(self):
         print("length joke")
 
@@ -118,19 +105,235 @@ class DanceBlock(BaseBlock):
         return '#%02x%02x%02x' % (int(r * 255), int(g * 255), int(b * 255))
 
 
-class Sequence:
-    def __init__(self):
-        self.dances: list[BaseBlock] = []
-                
-    def append(self, dance: BaseBlock):
-        self.dances.append(dance)
-                                    
-    def remove(self, dance: BaseBlock):
-        new_dances = []
-        for d in self.dances:
-            if d.id != dance.id:
-                new_dances.append(d)
-        self.dances = new_dances
-        
+class Placement: # a gesture placed at a beat offset inside a segment, referenced by its registry key
+    __slots__ = ("id", "gesture", "start", "length")
+
+    def __init__(self, id: int, gesture: str, start, length):
+        self.id = id
+        self.gesture = gesture
+        self.start = start
+        self.length = length
+
+    @property
+    def end(self):
+        return self.start + self.length
+
+
+class Sequence: # gestures of one segment, kept as disjoint beat intervals sorted by start
+    __slots__ = ("length_inbeats", "resolution", "gestures", "_ids", "_starts", "_placements", "_index")
+
+    def __init__(self, length_inbeats=np.inf, resolution=0.5, gestures: dict = None, ids=None):
+        self.length_inbeats = length_inbeats
+        self.resolution = resolution
+        self.gestures: dict[str, DanceBlock] = {} if gestures is None else gestures # registry key -> DanceBlock, shared by a composition
+        self._ids = itertools.count() if ids is None else ids
+        self._starts: list[float] = []
+        self._placements: list[Placement] = []
+        self._index: dict[int, Placement] = {} # placement id -> placement
+
+    @property
+    def dances(self):
+        return [self.gestures[p.gesture] for p in self._placements]
+
+    def dance(self, placement: Placement):
+        return self.gestures[placement.gesture]
+
+    def placements(self):
+        return list(self._placements)
+
+    def placement(self, placement_id: int):
+        return self._index.get(placement_id)
+
+    def find(self, placement_id: str): # placement with the given id string (as carried by drag and drop), or None
+        try:
+            return self._index.get(int(placement_id))
+        except ValueError:
+            return None
+
+    def __contains__(self, placement_id: int):
+        return placement_id in self._index
+
+    def __len__(self):
+        return len(self._placements)
+
     def __iter__(self):
-        return self.dances.__iter__()
+        return iter(self._placements)
+
+    def quantize(self, beat):
+        return round(beat / self.resolution) * self.resolution
+
+    def beats_used(self):
+        return sum(p.length for p in self._placements)
+
+    def beats_left(self):
+        return self.length_inbeats - self.beats_used()
+
+    def end(self): # beat where the last gesture finishes
+        return self._placements[-1].end if self._placements else 0.0
+
+    def fits(self, start, length, ignore: int = None): # O(log n): only the neighbours around start can overlap
+        if start < 0 or length <= 0 or start + length > self.length_inbeats:
+            return False
+        i = bisect.bisect_right(self._starts, start)
+        before = i - 1
+        if before >= 0 and self._placements[before].id == ignore:
+            before -= 1
+        if before >= 0 and self._placements[before].end > start:
+            return False
+        after = i
+        if after < len(self._placements) and self._placements[after].id == ignore:
+            after += 1
+        if after < len(self._placements) and self._placements[after].start < start + length:
+            return False
+        return True
+
+    def ceil(self, beat): # first grid beat at or after beat
+        return math.ceil(beat / self.resolution - 1e-9) * self.resolution
+
+    def first_fit(self, length, at=0.0): # earliest grid start >= at where length beats are free, so place() keeps it
+        start = self.ceil(max(at, 0.0))
+        i = bisect.bisect_right(self._starts, start) - 1
+        if i >= 0 and self._placements[i].end > start:
+            start = self.ceil(self._placements[i].end)
+        for p in self._placements[i + 1:]:
+            if start + length <= p.start:
+                break
+            start = max(start, self.ceil(p.end))
+        return start if self.fits(start, length) else None
+
+    def register(self, dance: DanceBlock): # registry key of a private copy of dance, shared by identical gestures
+        key, n = dance.name, 1
+        while key in self.gestures: # same name but other instructions (edited, or reloaded from disk) gets its own entry
+            if self.gestures[key].instructions.instructions == dance.instructions.instructions:
+                return key
+            n += 1
+            key = f"{dance.name}#{n}"
+        instructions = InstructionSet([list(row) for row in dance.instructions.instructions])
+        self.gestures[key] = DanceBlock(dance.name, instructions, dance.color)
+        return key
+
+    def place(self, dance: DanceBlock, start, length=None):
+        if length is None:
+            length = dance.length_accurate()
+        start = self.quantize(start)
+        if not self.fits(start, length):
+            raise ValueError(f"{dance.name} does not fit at beat {start}")
+        placement = Placement(next(self._ids), self.register(dance), start, length)
+        self._insert(placement)
+        return placement
+
+    def append(self, dance: DanceBlock):
+        return self.place(dance, self.end())
+
+    def move(self, placement_id: int, start):
+        placement = self._index[placement_id]
+        start = self.quantize(start)
+        if not self.fits(start, placement.length, ignore=placement_id):
+            raise ValueError(f"{placement.gesture} does not fit at beat {start}")
+        self._pop(placement)
+        placement.start = start
+        self._insert(placement)
+        return placement
+
+    def resize(self, placement_id: int, length):
+        placement = self._index[placement_id]
+        length = self.quantize(length)
+        if not self.fits(placement.start, length, ignore=placement_id):
+            raise ValueError(f"{placement.gesture} cannot be {length} beats long here")
+        placement.length = length
+        return placement
+
+    def edit(self, placement_id: int, instructions: InstructionSet): # copy on write: other placements keep the old gesture
+        placement = self._index[placement_id]
+        old = self.gestures[placement.gesture]
+        dance = DanceBlock(old.name, instructions, old.color)
+        if placement.length == old.length_accurate() and self.fits(placement.start, dance.length_accurate(), ignore=placement_id):
+            placement.length = dance.length_accurate() # unless it was resized, it keeps its natural length
+        placement.gesture = self.register(dance)
+        return placement
+
+    def remove(self, placement_id: int):
+        placement = self._index.get(placement_id)
+        if placement is not None:
+            self._pop(placement)
+        return placement
+
+    def clear(self): # True when there was anything to clear
+        if not self._placements:
+            return False
+        self._starts = []
+        self._placements = []
+        self._index = {}
+        return True
+
+    def _insert(self, placement: Placement):
+        i = bisect.bisect_right(self._starts, placement.start)
+        self._starts.insert(i, placement.start)
+        self._placements.insert(i, placement)
+        self._index[placement.id] = placement
+
+    def _pop(self, placement: Placement): # placements never overlap, so its start finds its position
+        i = bisect.bisect_left(self._starts, placement.start)
+        del self._starts[i]
+        del self._placements[i]
+        del self._index[placement.id]
+
+
+class Composition: # every segment of one song; segments share the gesture registry and the placement ids
+    __slots__ = ("segments", "gestures", "_ids")
+
+    def __init__(self, segment_lengths, resolution=0.5):
+        self.gestures: dict[str, DanceBlock] = {}
+        self._ids = itertools.count()
+        self.segments = [Sequence(length, resolution, self.gestures, self._ids) for length in segment_lengths]
+
+    def __len__(self):
+        return len(self.segments)
+
+    def __getitem__(self, index) -> Sequence:
+        return self.segments[index]
+
+    def __iter__(self):
+        return iter(self.segments)
+
+    def count(self):
+        return sum(len(s) for s in self.segments)
+
+    def clear(self): # indexes of the segments that had gestures
+        cleared = [i for i, s in enumerate(self.segments) if s.clear()]
+        self.prune()
+        return cleared
+
+    def clear_segment(self, index):
+        cleared = self.segments[index].clear()
+        self.prune()
+        return cleared
+
+    def prune(self): # forgets gestures no placement refers to any more
+        used = {p.gesture for s in self.segments for p in s._placements}
+        for name in [n for n in self.gestures if n not in used]:
+            del self.gestures[name]
+
+    def dances(self, offsets): # [gesture name, song beat] for every placement, offsets[i] is the first beat of segment i
+        return [[self.gestures[p.gesture].name.splitlines()[0], offsets[i] + p.start]
+                for i, s in enumerate(self.segments) for p in s._placements]
+
+    def timeline(self, offsets): # every motor instruction as [motor, beat, position, length] in song beats, sorted by beat
+        gestures = {} # each gesture converted once, however often it is placed
+        rows = []
+        for i, s in enumerate(self.segments):
+            for p in s._placements:
+                if p.gesture not in gestures:
+                    dance = self.gestures[p.gesture]
+                    gestures[p.gesture] = (np.asarray(dance.instructions.instructions, dtype=float).reshape(-1, 4),
+                                           dance.length_accurate())
+                instructions, natural = gestures[p.gesture]
+                instructions = instructions.copy()
+                stretch = p.length / natural # resized gestures play faster or slower
+                instructions[:, 1] = offsets[i] + p.start + instructions[:, 1] * stretch
+                instructions[:, 3] *= stretch
+                rows.append(instructions)
+        if not rows:
+            return np.zeros((0, 4))
+        timeline = np.concatenate(rows)
+        return timeline[np.argsort(timeline[:, 1], kind='stable')]
@@ -0,0 +1,47 @@
+import bisect
+import numpy as np
+
+# keeps track of which segment the playhead is in
+# segment starts are converted to pixels once per resize; during playback the cursor only
+# steps forward over the boundaries it passed (amortized O(1)) and seeks use bisection
+
+class SegmentCursor:
+    def __init__(self, starts_seconds, song_length):
+        self.starts_seconds = np.asarray(starts_seconds, dtype=float)
+        self.song_length = song_length
+        self.starts_list = self.starts_seconds.tolist() # plain floats, cheaper to compare than numpy scalars
+        self.index = 0
+        self.width = None
+        self.starts_pixels = None
+
+    def __len__(self):
+        return len(self.starts_list)
+
+    def resize(self, width):
+        self.width = width
+        self.starts_pixels = (self.starts_seconds / self.song_length * width).tolist()
+
+    def advance(self, seconds): # for the playhead moving forward; True when the segment changed
+        index = self.index
+        if seconds < self.starts_list[index]:
+            return self.seek(seconds)
+        while index + 1 < len(self.starts_list) and seconds >= self.starts_list[index + 1]:
+            index += 1
+        return self.set_index(index)
+
+    def seek(self, seconds): # for jumps anywhere in the song; True when the segment changed
+        return self.set_index(max(bisect.bisect_right(self.starts_list, seconds) - 1, 0))
+
+    def seek_pixels(self, x):
+        return self.set_index(max(bisect.bisect_right(self.starts_pixels, x) - 1, 0))
+
+    def set_index(self, index):
+        changed = index != self.index
+        self.index = index
+        return changed
+
+    def start_seconds(self, index=None):
+        return self.starts_list[self.index if index is None else index]
+
+    def start_pixels(self, index=None):
+        return self.starts_pixels[self.index if index is None else index]
@@ -0,0 +1,131 @@
+import os
+from collections import OrderedDict
+import json_handling
+import audio_io
+from tempo_map import TempoMap
+
+# a rehearsal session: several songs open at once, each with its own composition
+# the per-song audio, waveform pyramid and analysis live in one memory-bounded cache,
+# so songs that aren't on screen can be evicted and rebuilt on demand
+
+WAVEFORM_KERNEL = 127
+WAVEFORM_LEVELS = 4
+
+
+class BoundedCache: # least recently used entries are evicted once max_bytes is exceeded
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict() # key -> (value, nbytes)
+        self.nbytes = 0
+        self.pinned = set() # song keys that are never evicted (the song on screen)
+        self.hits = 0
+        self.misses = 0
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def get(self, key, loader, sizeof):
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.entries[key][0]
+        self.misses += 1
+        value = loader()
+        self.put(key, value, sizeof(value))
+        return value
+
+    def put(self, key, value, nbytes):
+        self.discard(key)
+        self.entries[key] = (value, nbytes)
+        self.nbytes += nbytes
+        self.evict()
+
+    def discard(self, key):
+        if key in self.entries:
+            self.nbytes -= self.entries.pop(key)[1]
+
+    def discard_song(self, song_key):
+        for key in [k for k in self.entries if k[0] == song_key]:
+            self.discard(key)
+
+    def evict(self):
+        for key in list(self.entries):
+            if self.nbytes <= self.max_bytes:
+                break
+            if key[0] not in self.pinned:
+                self.discard(key)
+
+
+class Song: # one open song; the composition itself lives in its Canvas
+    def __init__(self, json_path):
+        self.json_path = json_path
+        self.audio_path = audio_io.audio_path(json_path)
+        self.name = os.path.splitext(os.path.basename(json_path))[0]
+        self.key = os.path.abspath(json_path)
+
+
+class Analysis: # everything derived from the analysis json
+    def __init__(self, song: Song, audio):
+        self.sr = audio.sr
+        self.song_length = len(audio) / audio.sr
+        self.tempo_map = TempoMap.from_json(song.json_path, self.song_length, self.sr)
+        self.segmentation = json_handling.segmentation(song.json_path)
+        _, self.segmentation_indexes = json_handling.segmentation_beats(song.json_path) # beat index of every boundary
+
+    @property
+    def nbytes(self):
+        return self.tempo_map.beat_times.nbytes * 2 + self.segmentation.nbytes * 2
+
+
+class Session:
+    def __init__(self, max_cache_bytes=256 * 1024 * 1024):
+        self.songs: list[Song] = []
+        self.active: Song = None
+        self.cache = BoundedCache(max_cache_bytes)
+
+    def open_song(self, json_path):
+        for song in self.songs:
+            if song.key == os.path.abspath(json_path):
+                return song
+        song = Song(json_path)
+        self.songs.append(song)
+        return song
+
+    def close_song(self, song: Song):
+        self.songs.remove(song)
+        self.cache.pinned.discard(song.key)
+        self.cache.discard_song(song.key)
+        if self.active is song:
+            self.active = None
+
+    def activate(self, song: Song): # pins the song on screen, the others become evictable
+        self.active = song
+        self.cache.pinned = {song.key}
+        self.cache.evict()
+
+    def audio(self, song: Song):
+        return self.cache.get((song.key, 'audio'), lambda: self.load_audio(song), lambda a: a.nbytes)
+
+    @staticmethod
+    def load_audio(song: Song):
+        audio = audio_io.open_audio(song.audio_path)
+        if isinstance(audio, audio_io.DecodedAudio):
+            audio.decode() # so the cache sees its real size
+        return audio
+
+    def analysis(self, song: Song) -> Analysis:
+        return self.cache.get((song.key, 'analysis'), lambda: Analysis(song, audio_io.open_audio(song.audio_path)), lambda a: a.nbytes)
+
+    def waveform_pyramid(self, song: Song):
+        return self.cache.get((song.key, 'waveform'),
+                              lambda: audio_io.waveform_pyramid(self.audio(song), WAVEFORM_KERNEL, WAVEFORM_LEVELS),
+                              lambda p: sum(level.nbytes for level in p))
+
+    def waveform(self, song: Song, level=0): # peaks of WAVEFORM_KERNEL * 2**level samples
+        pyramid = self.waveform_pyramid(song)
+        return pyramid[min(level, len(pyramid) - 1)]
+
+    def waveform_for_width(self, song: Song, pixels): # coarsest level with at least two peaks per pixel, and its kernel
+        pyramid = self.waveform_pyramid(song)
+        level = next((n for n in reversed(range(len(pyramid))) if len(pyramid[n]) >= 2 * pixels), 0)
+        return pyramid[level], WAVEFORM_KERNEL * 2 ** level
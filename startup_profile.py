@@ -0,0 +1,92 @@
+import sys
+import time
+import importlib.abc
+
+# import-time profile for `python3 -m app --profile-startup`
+# times every module imported after install() and the named startup phases,
+# then prints the slowest imports (self time excludes the modules they import)
+
+class _TimedLoader(importlib.abc.Loader):
+    def __init__(self, profiler, loader):
+        self.profiler = profiler
+        self.loader = loader
+
+    def create_module(self, spec):
+        return self.loader.create_module(spec)
+
+    def exec_module(self, module):
+        self.profiler.enter(module.__name__)
+        try:
+            self.loader.exec_module(module)
+        finally:
+            self.profiler.exit(module.__name__)
+
+    def __getattr__(self, name): # anything else (get_data, get_filename...) goes to the real loader
+        return getattr(self.loader, name)
+
+
+class ImportProfiler(importlib.abc.MetaPathFinder):
+    def __init__(self):
+        self.records = {} # module -> [cumulative seconds, self seconds]
+        self.stack = [] # [module, start, time spent in nested imports]
+        self.phases = []
+        self.started = time.perf_counter()
+        self._finding = set()
+
+    def find_spec(self, fullname, path, target=None):
+        if fullname in self._finding:
+            return None
+        self._finding.add(fullname)
+        try:
+            for finder in sys.meta_path:
+                if finder is self or not hasattr(finder, 'find_spec'):
+                    continue
+                spec = finder.find_spec(fullname, path, target)
+                if spec is not None:
+                    if spec.loader is not None and hasattr(spec.loader, 'exec_module'):
+                        spec.loader = _TimedLoader(self, spec.loader)
+                    return spec
+            return None
+        finally:
+            self._finding.discard(fullname)
+
+    def enter(self, name):
+        self.stack.append([name, time.perf_counter(), 0.0])
+
+    def exit(self, name):
+        name, start, nested = self.stack.pop()
+        elapsed = time.perf_counter() - start
+        self.records[name] = [elapsed, elapsed - nested]
+        if self.stack:
+            self.stack[-1][2] += elapsed
+
+    def phase(self, name): # marks the end of a startup phase (imports done, window built, window shown...)
+        self.phases.append((name, time.perf_counter() - self.started))
+
+    def report(self, top=25, file=None):
+        file = sys.stderr if file is None else file
+        print("startup phases (s since profiling started):", file=file)
+        for name, t in self.phases:
+            print(f"  {t:8.3f}  {name}", file=file)
+        print(f"slowest imports of {len(self.records)} (cumulative / self, s):", file=file)
+        ranked = sorted(self.records.items(), key=lambda r: r[1][1], reverse=True)
+        for name, (cumulative, own) in ranked[:top]:
+            print(f"  {cumulative:8.3f}  {own:8.3f}  {name}", file=file)
+
+
+profiler = None
+
+def install():
+    global profiler
+    if profiler is None:
+        profiler = ImportProfiler()
+        sys.meta_path.insert(0, profiler)
+    return profiler
+
+def phase(name):
+    if profiler is not None:
+        profiler.phase(name)
+
+def report():
+    if profiler is not None:
+        profiler.report()
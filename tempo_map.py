@@ -0,0 +1,57 @@
+import numpy as np
+import json_handling
+
+# converts between beats, seconds and pixels using the beat timestamps of a song
+# beat n sits at beats[n] seconds, positions in between are interpolated linearly
+# and positions before the first / after the last beat use the tempo at that edge
+
+class TempoMap:
+    def __init__(self, beat_times, song_length, sr):
+        self.beat_times = np.asarray(beat_times, dtype=float)
+        assert len(self.beat_times) >= 2, "a tempo map needs at least two beats"
+        self.beat_numbers = np.arange(len(self.beat_times), dtype=float)
+        self.song_length = song_length # seconds
+        self.sr = sr
+        self.first_period = self.beat_times[1] - self.beat_times[0]
+        self.last_period = self.beat_times[-1] - self.beat_times[-2]
+
+    @classmethod
+    def from_json(cls, path, song_length, sr): # builds the map from the "beats" array, falling back to "tempo"
+        beat_times = json_handling.beats(path)
+        if len(beat_times) < 2:
+            beat_times = np.arange(0, song_length, 60 / json_handling.openjson(path)["tempo"])
+        return cls(beat_times, song_length, sr)
+
+    @property
+    def bpm(self): # typical tempo of the song, robust to a few missed beats
+        return 60 / np.median(np.diff(self.beat_times))
+
+    def beats_to_seconds(self, beats):
+        b = np.asarray(beats, dtype=float)
+        t = np.interp(b, self.beat_numbers, self.beat_times)
+        t = np.where(b < 0, self.beat_times[0] + b * self.first_period, t)
+        t = np.where(b > self.beat_numbers[-1], self.beat_times[-1] + (b - self.beat_numbers[-1]) * self.last_period, t)
+        return self._out(t)
+
+    def seconds_to_pixels(self, seconds, width):
+        return self._out(np.asarray(seconds, dtype=float) / self.song_length * width)
+
+    def pixels_to_seconds(self, pixels, width):
+        return self._out(np.asarray(pixels, dtype=float) / width * self.song_length)
+
+    def beat_span_seconds(self, start_beat, length): # duration of length beats starting at start_beat
+        return self.beats_to_seconds(np.asarray(start_beat) + length) - self.beats_to_seconds(start_beat)
+
+    def nearest_beat(self, seconds): # index of the beat closest to a time
+        t = np.asarray(seconds, dtype=float)
+        i = np.clip(np.searchsorted(self.beat_times, t), 1, len(self.beat_times) - 1)
+        i = np.where(t - self.beat_times[i - 1] <= self.beat_times[i] - t, i - 1, i)
+        return self._out(i)
+
+    def quantize_pixels(self, pixels, width): # snaps a pixel position to the closest beat
+        beat = self.nearest_beat(self.pixels_to_seconds(pixels, width))
+        return self.seconds_to_pixels(self.beat_times[beat], width)
+
+    @staticmethod
+    def _out(x): # plain python scalars for scalar input, arrays otherwise
+        return x.item() if np.ndim(x) == 0 else x